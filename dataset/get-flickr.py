@@ -1,11 +1,67 @@
 import requests
 import os
 import csv
+import time
 import random
 import json
-from io import BytesIO
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
 from PIL import Image
 
+download_workers = 8
+requests_per_second = 5
+request_timeout = 60
+chunk_size = 64 * 1024
+image_extensions = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+backoff_base = 1.0
+backoff_max = 30.0
+
+flickr_endpoint = 'https://api.flickr.com/services/rest/'
+search_workers = 4
+api_requests_per_second = 1
+search_cache_folder = 'dataset/cache'
+search_cache_ttl = 24 * 60 * 60
+ledger_filename = 'downloads.jsonl'
+ledger_lock = threading.Lock()
+
+class RateLimiter:
+  def __init__(self, rate, burst=1):
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.updated = time.monotonic()
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    while True:
+      with self.lock:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        wait_time = (1 - self.tokens) / self.rate
+      time.sleep(wait_time)
+
+def make_session(pool_size=download_workers):
+  session = requests.Session()
+  adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+  session.mount('http://', adapter)
+  session.mount('https://', adapter)
+  return session
+
+def backoff_delay(attempt, response=None):
+  retry_after = response.headers.get('Retry-After') if response is not None else None
+  if retry_after and retry_after.isdigit():
+    return min(backoff_max, int(retry_after))
+  return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+def is_retryable(response):
+  return response.status_code == 429 or response.status_code >= 500
+
 def ensure_directory_exists(directory):
   os.makedirs(directory, exist_ok=True)
 
@@ -22,63 +78,255 @@ def load_api_key(json_file='dataset/api-key.json'):
     print("Error: There was an issue decoding the JSON file.")
     raise
 
-def search_photos(api_key, institution_id, num_photos=1500):
-  url = 'https://api.flickr.com/services/rest/?method=flickr.photos.search'
+def search_cache_path(endpoint, params):
+  key = {name: value for name, value in params.items() if name != 'api_key'}
+  key['endpoint'] = endpoint
+  digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:32]
+  return os.path.join(search_cache_folder, f"{digest}.json")
+
+def fetch_search_page(session, endpoint, params, limiter=None, retries=3, cache_ttl=search_cache_ttl):
+  cache_path = search_cache_path(endpoint, params)
+  if os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < cache_ttl:
+    with open(cache_path, 'r') as f:
+      return json.load(f)
+
+  for attempt in range(retries):
+    response = None
+    try:
+      if limiter:
+        limiter.acquire()
+      response = session.get(endpoint, params=params, timeout=request_timeout)
+      response.raise_for_status()
+      data = response.json()
+      if data.get('stat') == 'fail':
+        raise ValueError(data.get('message'))
+      break
+    except Exception as e:
+      print(f"Attempt {attempt + 1}: Failed to search photos (page {params['page']}): {e}")
+      if attempt == retries - 1 or (isinstance(e, requests.HTTPError) and not is_retryable(response)):
+        return None
+      time.sleep(backoff_delay(attempt, response))
+
+  ensure_directory_exists(search_cache_folder)
+  temp_path = f"{cache_path}.tmp"
+  with open(temp_path, 'w') as f:
+    json.dump(data, f)
+  os.replace(temp_path, cache_path)
+  return data
+
+def landscape_photos(data):
   image_data = []
-  page = 1
-
-  while len(image_data) < num_photos:
-    params = {
-      'api_key': api_key,
-      'user_id': institution_id,
-      'extras': 'url_o,width_o,height_o',
-      'format': 'json',
-      'nojsoncallback': 1,
-      'per_page': 100,
-      'page': page
-    }
-
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-      photos = response.json().get("photos", {}).get("photo", [])
-      for photo in photos:
-        width = photo.get('width_o', 0)
-        if photo.get('url_o') and width >= 1500 and width > photo.get('height_o', 0):
-          image_data.append((photo['url_o'], photo['title'], width, photo['height_o']))
-
-      if not photos or len(image_data) >= num_photos:
+  for photo in data.get("photos", {}).get("photo", []):
+    width = int(photo.get('width_o', 0))
+    height = int(photo.get('height_o', 0))
+    if photo.get('url_o') and width >= 1500 and width > height:
+      image_data.append((photo['url_o'], photo['title'], width, height))
+  return image_data
+
+def search_photos(api_key, institution_id, num_photos=1500, endpoint=flickr_endpoint, session=None, workers=search_workers):
+  session = session or make_session(workers)
+  limiter = RateLimiter(api_requests_per_second, burst=workers)
+  params = {
+    'method': 'flickr.photos.search',
+    'api_key': api_key,
+    'user_id': institution_id,
+    'extras': 'url_o,width_o,height_o',
+    'format': 'json',
+    'nojsoncallback': 1,
+    'per_page': 100
+  }
+
+  first = fetch_search_page(session, endpoint, dict(params, page=1), limiter)
+  if first is None:
+    return []
+  image_data = landscape_photos(first)
+  pages = int(first.get("photos", {}).get("pages", 1))
+
+  # Pages are fetched in batches of `workers` and filtered in page order, so the result matches
+  # a serial walk and no more pages are requested than needed.
+  exhausted = False
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    for batch_start in range(2, pages + 1, workers):
+      if exhausted or len(image_data) >= num_photos:
         break
+      batch = range(batch_start, min(pages, batch_start + workers - 1) + 1)
+      responses = executor.map(lambda page: fetch_search_page(session, endpoint, dict(params, page=page), limiter), batch)
 
-      page += 1
-    else:
-      print(f"Failed to search photos: {response.status_code}")
-      break
+      for data in responses:
+        if data is None or not data.get("photos", {}).get("photo"):
+          exhausted = True
+          break
+        image_data += landscape_photos(data)
 
   random.shuffle(image_data)
   return image_data[:num_photos]
 
-def download_and_save_image(image_url, title, save_dir='implementation/target', retries=3):
+def image_stem(save_dir, title):
+  return os.path.join(save_dir, title.replace('/', '_'))
+
+def unique_targets(rows, save_dir='implementation/target'):
+  # File names come from the title alone and titles are not unique, so two rows sharing one would
+  # download into the same .part file at the same time. Only the first of them is kept.
+  seen = set()
+  for row in rows:
+    stem = image_stem(save_dir, row[1])
+    if stem in seen:
+      print(f"Skipping '{row[1]}' ({row[0]}): an earlier image is saved under the same file name.")
+      continue
+    seen.add(stem)
+    yield row
+
+def existing_image(stem):
+  for extension in image_extensions.values():
+    if os.path.exists(stem + extension):
+      return stem + extension
+  return None
+
+def validate_image(path, expected_size=None):
+  # Image.open only parses the header; the pixel data is never decoded.
+  with Image.open(path) as img:
+    if img.format not in image_extensions:
+      raise ValueError(f"unsupported format {img.format}")
+    if expected_size and img.size != tuple(expected_size):
+      raise ValueError(f"expected {expected_size[0]}x{expected_size[1]}, got {img.width}x{img.height}")
+    return img.format
+
+def load_ledger(ledger_path):
+  records = {}
+  if not os.path.exists(ledger_path):
+    return records
+
+  with open(ledger_path, 'r') as f:
+    for line in f:
+      try:
+        record = json.loads(line)
+      except json.JSONDecodeError:
+        continue
+      records[record['url']] = record
+  return records
+
+def append_ledger(ledger_path, ledger, record):
+  with ledger_lock:
+    ledger[record['url']] = record
+    with open(ledger_path, 'a') as f:
+      f.write(json.dumps(record) + '\n')
+      f.flush()
+      os.fsync(f.fileno())
+
+def write_ledger(ledger_path, ledger):
+  with ledger_lock:
+    temp_path = ledger_path + '.tmp'
+    with open(temp_path, 'w') as f:
+      for url in sorted(ledger):
+        f.write(json.dumps(ledger[url]) + '\n')
+    os.replace(temp_path, ledger_path)
+
+def file_sha256(path):
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+      digest.update(chunk)
+  return digest
+
+def verify_download(path, record):
+  return (record and record.get('complete') and os.path.getsize(path) == record['expected_length']
+          and file_sha256(path).hexdigest() == record['sha256'])
+
+def stream_to_file(response, path, offset, digest):
+  received = offset
+  with open(path, 'r+b' if offset else 'wb') as f:
+    f.seek(offset)
+    f.truncate()
+    for chunk in response.iter_content(chunk_size):
+      f.write(chunk)
+      digest.update(chunk)
+      received += len(chunk)
+  return received
+
+def expected_length(response, offset):
+  if response.status_code == 206:
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+  length = response.headers.get('Content-Length')
+  return int(length) if length else None
+
+def download_and_save_image(image_url, title, save_dir='implementation/target', retries=3, session=None, limiter=None, expected_size=None, ledger_path=None, ledger=None):
+  session = session or requests
+  ledger = ledger if ledger is not None else {}
   ensure_directory_exists(save_dir)
-  image_filename = os.path.join(save_dir, f"{title.replace('/', '_')}.jpg")
+  stem = image_stem(save_dir, title)
 
-  if os.path.exists(image_filename):
-    print(f"Image '{title}' already exists. Skipping download.")
-    return os.path.getsize(image_filename) / 1024
+  image_filename = existing_image(stem)
+  record = ledger.get(image_url)
+  if image_filename:
+    if not record or verify_download(image_filename, record):
+      print(f"Image '{title}' already exists. Skipping download.")
+      return os.path.getsize(image_filename) / 1024
+    print(f"Image '{title}' does not match its recorded checksum. Downloading again.")
+    os.remove(image_filename)
+    record = None
 
+  temp_path = f"{stem}.part"
   for attempt in range(retries):
+    response = None
+    offset = os.path.getsize(temp_path) if record and os.path.exists(temp_path) else 0
     try:
-      image_data = requests.get(image_url)
-      image_data.raise_for_status()
-      img = Image.open(BytesIO(image_data.content))
-      img.save(image_filename)
+      if limiter:
+        limiter.acquire()
+
+      headers = {'Accept-Encoding': 'identity'}
+      if offset:
+        headers['Range'] = f"bytes={offset}-"
+        if record.get('validator'):
+          headers['If-Range'] = record['validator']
+
+      with session.get(image_url, timeout=request_timeout, stream=True, headers=headers) as response:
+        if response.status_code == 416:
+          if offset != record.get('expected_length'):
+            os.remove(temp_path)
+            record = None
+            raise IOError("stored partial download cannot be resumed")
+          received, length, digest = offset, offset, file_sha256(temp_path)
+        else:
+          response.raise_for_status()
+          if response.status_code != 206:
+            offset = 0
+          digest = file_sha256(temp_path) if offset else hashlib.sha256()
+          length = expected_length(response, offset)
+          validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+          if offset:
+            print(f"Resuming '{title}' from byte {offset}")
+
+          record = {'url': image_url, 'path': temp_path, 'expected_length': length, 'received': offset, 'validator': validator, 'complete': False}
+          try:
+            received = stream_to_file(response, temp_path, offset, digest)
+          finally:
+            if ledger_path:
+              append_ledger(ledger_path, ledger, dict(record, received=os.path.getsize(temp_path)))
+
+      if length is not None and received != length:
+        raise IOError(f"received {received} of {length} bytes")
+
+      try:
+        image_filename = stem + image_extensions[validate_image(temp_path, expected_size)]
+      except Exception:
+        os.remove(temp_path)
+        record = None
+        raise
+      os.replace(temp_path, image_filename)
+
+      if ledger_path:
+        append_ledger(ledger_path, ledger, dict(record, path=image_filename, expected_length=received, received=received, sha256=digest.hexdigest(), complete=True))
 
       file_size_kb = os.path.getsize(image_filename) / 1024
       print(f"Image '{title}' saved as {image_filename} ({file_size_kb:.2f} KB)")
       return file_size_kb
     except Exception as e:
       print(f"Attempt {attempt + 1}: Failed to download or save the image '{title}': {e}")
-      if attempt < retries - 1:
-        print("Retrying...")
+      if attempt < retries - 1 and not (isinstance(e, requests.HTTPError) and not is_retryable(response)):
+        delay = backoff_delay(attempt, response)
+        print(f"Retrying in {delay:.1f} s...")
+        time.sleep(delay)
       else:
         return None
 
@@ -94,27 +342,48 @@ def create_csv(image_data, filename='dataset/dataset.csv'):
 
   print(f"CSV file saved as '{filename}'.")
 
-def download_images_from_csv(csv_filename='dataset/dataset.csv', max_downloads=1000):
+def download_images_from_csv(csv_filename='dataset/dataset.csv', max_downloads=1000, workers=download_workers, session=None, limiter=None, save_dir='implementation/target'):
+  session = session or make_session(workers)
+  limiter = limiter or RateLimiter(requests_per_second)
+  ledger_path = os.path.join(os.path.dirname(csv_filename), ledger_filename)
+  ledger = load_ledger(ledger_path)
   failed_downloads = []
   downloaded_images = 0
   try:
     with open(csv_filename, mode='r', encoding='utf-8') as file:
       reader = csv.reader(file)
       header = next(reader)
-      data_rows = []
+      results = {}
+      pending = {}
 
-      for row in reader:
-        if downloaded_images >= max_downloads:
-          break
+      def collect(futures):
+        for future in futures:
+          index, row = pending.pop(future)
+          file_size_kb = future.result()
+          if file_size_kb is not None:
+            results[index] = [row[0], row[1], row[2], row[3], f"{file_size_kb:.2f}"]
+          else:
+            failed_downloads.append((row[0], row[1]))
 
-        image_url = row[0]
-        title = row[1]
-        file_size_kb = download_and_save_image(image_url, title)
-        if file_size_kb is not None:
-          data_rows.append([image_url, title, row[2], row[3], f"{file_size_kb:.2f}"])
-          downloaded_images += 1
-        else:
-          failed_downloads.append((image_url, title))
+      # Keep at most as many downloads in flight as successes still needed, so failures are
+      # replaced by later rows and no more than max_downloads images are fetched.
+      with ThreadPoolExecutor(max_workers=workers) as executor:
+        for index, row in enumerate(unique_targets(reader, save_dir)):
+          while pending and (len(pending) >= workers or len(results) + len(pending) >= max_downloads):
+            collect(wait(pending, return_when=FIRST_COMPLETED)[0])
+
+          if len(results) >= max_downloads:
+            break
+
+          expected_size = (int(row[2]), int(row[3])) if row[2].isdigit() and row[3].isdigit() else None
+          pending[executor.submit(download_and_save_image, row[0], row[1], save_dir, session=session, limiter=limiter, expected_size=expected_size, ledger_path=ledger_path, ledger=ledger)] = (index, row)
+
+        collect(list(pending))
+
+      write_ledger(ledger_path, ledger)
+
+      downloaded_images = len(results)
+      data_rows = [results[index] for index in sorted(results)]
 
     with open(csv_filename, mode='w', newline='', encoding='utf-8') as file:
       writer = csv.writer(file)
@@ -127,19 +396,26 @@ def download_images_from_csv(csv_filename='dataset/dataset.csv', max_downloads=1
   print(f"Downloaded {downloaded_images} images.")
   return failed_downloads
 
-def retry_failed_downloads(failed_downloads):
+def retry_failed_downloads(failed_downloads, csv_filename='dataset/dataset.csv'):
   if not failed_downloads:
     print("No failed downloads to retry.")
     return
 
   print("\nRetrying failed downloads...")
-  for image_url, title in failed_downloads:
-    print(f"Retrying download for '{title}'...")
-    file_size_kb = download_and_save_image(image_url, title)
-    if file_size_kb is not None:
-      print(f"Successfully retried '{title}'")
-    else:
-      print(f"Failed to download '{title}' again.")
+  session = make_session()
+  limiter = RateLimiter(requests_per_second)
+  ledger_path = os.path.join(os.path.dirname(csv_filename), ledger_filename)
+  ledger = load_ledger(ledger_path)
+
+  with ThreadPoolExecutor(max_workers=download_workers) as executor:
+    futures = [(title, executor.submit(download_and_save_image, image_url, title, session=session, limiter=limiter, ledger_path=ledger_path, ledger=ledger)) for image_url, title in unique_targets(failed_downloads)]
+    for title, future in futures:
+      if future.result() is not None:
+        print(f"Successfully retried '{title}'")
+      else:
+        print(f"Failed to download '{title}' again.")
+
+  write_ledger(ledger_path, ledger)
 
 def main():
   api_key = load_api_key()
@@ -161,4 +437,5 @@ def main():
   else:
     print("No landscape images found.")
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+  main()
\ No newline at end of file
@@ -1,9 +1,25 @@
 import os
+import re
+import math
+import sys
 import csv
+import json
+import importlib.util
+from html.parser import HTMLParser
 import matplotlib.pyplot as plt
 
 plt.rcParams['font.family'] = 'Times New Roman'
 
+def load_script(path, name):
+  spec = importlib.util.spec_from_file_location(name, path)
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  spec.loader.exec_module(module)
+  return module
+
+calc_waste = load_script('waste/calc-waste.py', 'calc_waste')
+calc_pruner = load_script('waste/calc-pruner.py', 'calc_pruner')
+
 def get_folder_size(folder_path):
   total_size = 0
   for dirpath, dirnames, filenames in os.walk(folder_path):
@@ -24,24 +40,217 @@ def get_pruner_js_size(folder_path):
   return os.path.getsize(pruner_js_path) if os.path.exists(pruner_js_path) else 0
 
 def count_image_assets(folder_path):
-  images_folder = os.path.join(folder_path, 'images')
-  if os.path.exists(images_folder):
-    return len([f for f in os.listdir(images_folder) if f.lower().endswith('.webp')])
-  return 0
+  return len([f for f in os.listdir(folder_path) if f.lower().endswith('.webp')])
+
+folder_types = {
+  'picture_element_3': 'picture-3',
+  'picture_element_5': 'picture-5',
+  'srcset_3': 'srcset-3',
+  'srcset_5': 'srcset-5',
+  'benchmark': 'benchmark',
+  'pruner': 'pruner'
+}
+
+sizes_path = 'implementation/assets/image-sizes.json'
+if os.path.exists(sizes_path):
+  with open(sizes_path, 'r') as f:
+    folder_types.update({method.replace('-', '_'): method for method in json.load(f)})
+
+def empty_sizes():
+  return {key: {'size': 0, 'html_size': 0, 'requests': 0, 'pruner_js_size': 0} for key in folder_types}
+
+def read_manifest(manifest_path):
+  records = {}
+  with open(manifest_path, 'r') as f:
+    for line in f:
+      try:
+        record = json.loads(line)
+      except json.JSONDecodeError:
+        continue
+      records[record['folder']] = record
+  return records
+
+def folder_sizes_from_manifest(record):
+  folder_sizes = empty_sizes()
+
+  for folder_type, method in folder_types.items():
+    entry = record['methods'].get(method)
+    if not entry:
+      continue
+
+    for output in entry['outputs']:
+      folder_sizes[folder_type]['size'] += output['bytes']
+      if output['role'] == 'html':
+        folder_sizes[folder_type]['html_size'] += output['bytes']
+      elif output['role'] == 'js':
+        folder_sizes[folder_type]['pruner_js_size'] += output['bytes']
+      elif output['role'] in ('image', 'pack'):
+        folder_sizes[folder_type]['requests'] += 1
+
+  return folder_sizes
+
+def folder_sizes_from_tree(folder_path):
+  folder_sizes = empty_sizes()
+
+  for folder_type, method in folder_types.items():
+    path = os.path.join(folder_path, method)
+    if os.path.exists(path):
+      folder_sizes[folder_type]['size'] += get_folder_size(path)
+      folder_sizes[folder_type]['html_size'] += get_html_file_size(path)
+      folder_sizes[folder_type]['pruner_js_size'] += get_pruner_js_size(path) if folder_type == 'pruner' else 0
+      folder_sizes[folder_type]['requests'] += count_image_assets(path)
+
+  return folder_sizes
+
+def iter_folder_sizes(output_folder):
+  manifest_path = os.path.join(output_folder, 'manifest.jsonl')
+
+  if os.path.exists(manifest_path):
+    for folder_name, record in sorted(read_manifest(manifest_path).items()):
+      yield folder_name, folder_sizes_from_manifest(record)
+    return
+
+  for folder_name in os.listdir(output_folder):
+    folder_path = os.path.join(output_folder, folder_name)
+    if os.path.isdir(folder_path) and not folder_name.startswith('.'):
+      yield folder_name, folder_sizes_from_tree(folder_path)
+
+class PageParser(HTMLParser):
+  def __init__(self):
+    super().__init__()
+    self.sources = []
+    self.img = {}
+    self.scripts = []
+
+  def handle_starttag(self, tag, attrs):
+    attrs = dict(attrs)
+    if tag == 'source':
+      self.sources.append(attrs)
+    elif tag == 'img':
+      self.img = attrs
+    elif tag == 'script' and attrs.get('src'):
+      self.scripts.append(attrs['src'])
+
+def parse_page(html):
+  parser = PageParser()
+  parser.feed(html)
+  return parser
+
+def select_picture_source(page, viewport_width):
+  for source in page.sources:
+    match = re.search(r'max-width:\s*(\d+)px', source.get('media', ''))
+    if match and viewport_width <= int(match.group(1)):
+      return source['srcset'].split()[0]
+  return page.img['src']
+
+def select_srcset_candidate(page, viewport_width, density):
+  candidates = sorted(
+    (int(descriptor[:-1]), url)
+    for url, descriptor in (candidate.split() for candidate in page.img['srcset'].split(','))
+  )
+  for width, url in candidates:
+    if width >= viewport_width * density:
+      return url
+  return candidates[-1][1]
+
+def coalesce_ranges(pack, tiles):
+  offsets = [0]
+  for length in pack['lengths']:
+    offsets.append(offsets[-1] + length)
+
+  ranges = []
+  for tile in sorted(tiles):
+    start, end = offsets[tile - 1], offsets[tile] - 1
+    if ranges and ranges[-1][1] + 1 == start:
+      ranges[-1][1] = end
+    else:
+      ranges.append([start, end])
+
+  return [f"{pack['file']}#bytes={start}-{end}" for start, end in ranges]
+
+def select_pruner_tiles(page, viewport_width, viewport_height, artifacts):
+  data = json.loads(page.img['data-pruner'])
+  columns, rows = map(int, data['tile'].split())
+
+  if 'pack' in data:
+    tile_width, tile_height = map(int, data['pack']['size'].split())
+    tiles = calc_pruner.pruner_visible_tiles(viewport_width, viewport_height, columns, rows, tile_width, tile_height)
+    return coalesce_ranges(data['pack'], tiles)
+
+  probe = f"{data['name']}-1.webp"
+  tiles = calc_pruner.pruner_visible_tiles(viewport_width, viewport_height, columns, rows, artifacts[probe]['width'], artifacts[probe]['height'])
+  return [f"{data['name']}-{tile}.webp" for tile in sorted(set([1] + tiles))]
+
+def page_requests(page, viewport_width, viewport_height, density, artifacts):
+  if 'data-pruner' in page.img:
+    images = select_pruner_tiles(page, viewport_width, viewport_height, artifacts)
+  elif page.sources:
+    images = [select_picture_source(page, viewport_width)]
+  elif 'srcset' in page.img:
+    images = [select_srcset_candidate(page, viewport_width, density)]
+  else:
+    images = [page.img['src']]
+  return ['index.html'] + images + page.scripts
+
+def request_bytes(url, artifacts):
+  if '#bytes=' in url:
+    start, end = map(int, url.split('#bytes=')[1].split('-'))
+    return end - start + 1
+  return artifacts[url]['bytes']
+
+def percentile(values, p):
+  ordered = sorted(values)
+  index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+  return ordered[index]
+
+def simulate_transfers(output_folder, viewports, densities, csv_file):
+  manifest_path = os.path.join(output_folder, 'manifest.jsonl')
+  if not os.path.exists(manifest_path):
+    print("No build manifest found, skipping transfer simulation.")
+    return {}
+
+  transfers = {method: [] for method in folder_types.values()}
+
+  with open(csv_file, mode='w', newline='') as file:
+    writer = csv.writer(file)
+    writer.writerow(['Folder ID', 'Method', 'Viewport', 'DPR', 'Requests', 'Transferred (KB)'])
+
+    for folder_name, record in sorted(read_manifest(manifest_path).items()):
+      for method, entry in record['methods'].items():
+        if method not in transfers:
+          continue
+
+        artifacts = {os.path.basename(output['path']): output for output in entry['outputs']}
+        with open(os.path.join(output_folder, folder_name, method, 'index.html'), 'r') as f:
+          page = parse_page(f.read())
+
+        for viewport_width, viewport_height in viewports:
+          for density in densities:
+            requests = [url for url in page_requests(page, viewport_width, viewport_height, density, artifacts) if url.split('#')[0] in artifacts]
+            transferred = sum(request_bytes(url, artifacts) for url in requests)
+            transfers[method].append((transferred, len(requests)))
+            writer.writerow([folder_name, method, f"{viewport_width}x{viewport_height}", density, len(requests), bytes_to_kb(transferred)])
+
+  print("\nTransferred per page view (KB / requests):")
+  for method, samples in transfers.items():
+    if not samples:
+      continue
+    transferred = [bytes_to_kb(size) for size, count in samples]
+    requests = [count for size, count in samples]
+    print(f"{method}: mean {sum(transferred) / len(transferred):.1f}, "
+          f"p10 {percentile(transferred, 10):.1f}, p50 {percentile(transferred, 50):.1f}, "
+          f"p90 {percentile(transferred, 90):.1f}, p99 {percentile(transferred, 99):.1f} KB; "
+          f"requests p50 {percentile(requests, 50)}, p90 {percentile(requests, 90)}, max {max(requests)}")
+
+  return transfers
 
 def main():
   current_directory = os.getcwd()
   output_folder = os.path.join(current_directory, 'implementation', 'processed')
   csv_file = os.path.join(current_directory, 'implementation', 'results.csv')
+  transfer_csv_file = os.path.join(current_directory, 'implementation', 'transfer.csv')
   
-  total_sizes = {
-    'benchmark': {'size': 0, 'html_size': 0, 'requests': 0, 'pruner_js_size': 0},
-    'picture_element_3': {'size': 0, 'html_size': 0, 'requests': 0, 'pruner_js_size': 0},
-    'picture_element_5': {'size': 0, 'html_size': 0, 'requests': 0, 'pruner_js_size': 0},
-    'srcset_3': {'size': 0, 'html_size': 0, 'requests': 0, 'pruner_js_size': 0},
-    'srcset_5': {'size': 0, 'html_size': 0, 'requests': 0, 'pruner_js_size': 0},
-    'pruner': {'size': 0, 'html_size': 0, 'requests': 0, 'pruner_js_size': 0}
-  }
+  total_sizes = empty_sizes()
   
   folder_count = 0
 
@@ -54,56 +263,31 @@ def main():
                      'Srcset-5 Images (KB)', 'Srcset-5 HTML (KB)',
                      'Benchmark Image (KB)', 'Benchmark HTML (KB)'])
 
-    for folder_name in os.listdir(output_folder):
-      folder_path = os.path.join(output_folder, folder_name)
-
-      if os.path.isdir(folder_path):
-        folder_count += 1
-
-        folder_sizes = {key: {'size': 0, 'html_size': 0, 'requests': 0, 'pruner_js_size': 0} for key in total_sizes.keys()}
-
-        folder_types = {
-          'picture_element_3': os.path.join(folder_path, 'picture-3'),
-          'picture_element_5': os.path.join(folder_path, 'picture-5'),
-          'srcset_3': os.path.join(folder_path, 'srcset-3'),
-          'srcset_5': os.path.join(folder_path, 'srcset-5'),
-          'benchmark': os.path.join(folder_path, 'benchmark'),
-          'pruner': os.path.join(folder_path, 'pruner')
-        }
-
-        for folder_type, path in folder_types.items():
-          if os.path.exists(path):
-            folder_size = get_folder_size(path)
-            html_size = get_html_file_size(path)
-            pruner_js_size = get_pruner_js_size(path) if folder_type == 'pruner' else 0
-            image_requests = count_image_assets(path)
-
-            folder_sizes[folder_type]['size'] += folder_size
-            folder_sizes[folder_type]['html_size'] += html_size
-            folder_sizes[folder_type]['pruner_js_size'] += pruner_js_size
-            folder_sizes[folder_type]['requests'] += image_requests
-
-            total_sizes[folder_type]['size'] += folder_size
-            total_sizes[folder_type]['html_size'] += html_size
-            total_sizes[folder_type]['pruner_js_size'] += pruner_js_size
-            total_sizes[folder_type]['requests'] += image_requests
-
-        writer.writerow([
-          folder_name,
-          bytes_to_kb(folder_sizes['pruner']['size']),
-          bytes_to_kb(folder_sizes['pruner']['html_size']),
-          bytes_to_kb(folder_sizes['pruner']['pruner_js_size']),
-          bytes_to_kb(folder_sizes['picture_element_3']['size']),
-          bytes_to_kb(folder_sizes['picture_element_3']['html_size']),
-          bytes_to_kb(folder_sizes['picture_element_5']['size']),
-          bytes_to_kb(folder_sizes['picture_element_5']['html_size']),
-          bytes_to_kb(folder_sizes['srcset_3']['size']),
-          bytes_to_kb(folder_sizes['srcset_3']['html_size']),
-          bytes_to_kb(folder_sizes['srcset_5']['size']),
-          bytes_to_kb(folder_sizes['srcset_5']['html_size']),
-          bytes_to_kb(folder_sizes['benchmark']['size']),
-          bytes_to_kb(folder_sizes['benchmark']['html_size']),
-        ])
+    for folder_name, folder_sizes in iter_folder_sizes(output_folder):
+      folder_count += 1
+
+      for folder_type, sizes in folder_sizes.items():
+        for key, value in sizes.items():
+          total_sizes[folder_type][key] += value
+
+      writer.writerow([
+        folder_name,
+        bytes_to_kb(folder_sizes['pruner']['size']),
+        bytes_to_kb(folder_sizes['pruner']['html_size']),
+        bytes_to_kb(folder_sizes['pruner']['pruner_js_size']),
+        bytes_to_kb(folder_sizes['picture_element_3']['size']),
+        bytes_to_kb(folder_sizes['picture_element_3']['html_size']),
+        bytes_to_kb(folder_sizes['picture_element_5']['size']),
+        bytes_to_kb(folder_sizes['picture_element_5']['html_size']),
+        bytes_to_kb(folder_sizes['srcset_3']['size']),
+        bytes_to_kb(folder_sizes['srcset_3']['html_size']),
+        bytes_to_kb(folder_sizes['srcset_5']['size']),
+        bytes_to_kb(folder_sizes['srcset_5']['html_size']),
+        bytes_to_kb(folder_sizes['benchmark']['size']),
+        bytes_to_kb(folder_sizes['benchmark']['html_size']),
+      ])
+
+  simulate_transfers(output_folder, calc_waste.get_common_viewport_sizes(), [1, 2], transfer_csv_file)
 
   if folder_count > 0:
     methods = ['Benchmark', 'Picture-3', 'Picture-5', 'Srcset-3', 'Srcset-5', 'Pruner.js']
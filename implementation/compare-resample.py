@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import importlib.util
+from statistics import mean, median
+
+def load_script(path, name):
+  spec = importlib.util.spec_from_file_location(name, path)
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  spec.loader.exec_module(module)
+  return module
+
+# The scripts load each other, and read their inputs, by paths relative to the repository root,
+# so run from there whatever the working directory.
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+process_images = load_script('implementation/process-images.py', 'process_images')
+
+def render(image_path, target_width, target_height, fast):
+  start = time.perf_counter()
+  with process_images.open_source(image_path, [(target_width, target_height)], fast) as img:
+    img.load()
+    source_size = img.size
+    result = process_images.resize_and_crop(img, target_width, target_height, fast)
+  return result, source_size, time.perf_counter() - start
+
+def compare_resample(image_paths, target_width=1920, target_height=1080):
+  results = []
+
+  for image_path in image_paths:
+    exact, exact_size, exact_time = render(image_path, target_width, target_height, False)
+    fast, fast_size, fast_time = render(image_path, target_width, target_height, True)
+    score = process_images.psnr(exact, fast)
+    results.append((image_path, exact_size, fast_size, exact_time, fast_time, score))
+
+    print(f"{os.path.basename(image_path)}: {exact_size[0]}x{exact_size[1]} -> {fast_size[0]}x{fast_size[1]}, "
+          f"exact {exact_time * 1000:.0f} ms, fast {fast_time * 1000:.0f} ms, "
+          f"speed-up {exact_time / fast_time:.2f}x, PSNR {score:.2f} dB")
+
+  return results
+
+def main():
+  target_folder = 'implementation/target'
+  sample_size = 50
+
+  valid_extensions = ['.jpg', '.jpeg', '.png', '.webp']
+  images = sorted(f for f in os.listdir(target_folder) if any(f.lower().endswith(ext) for ext in valid_extensions)) if os.path.isdir(target_folder) else []
+  sample = [os.path.join(target_folder, f) for f in images[:sample_size]]
+
+  if not sample:
+    print(f"No images found in {target_folder}")
+    return
+
+  results = compare_resample(sample)
+  exact_total = sum(r[3] for r in results)
+  fast_total = sum(r[4] for r in results)
+  scores = [r[5] for r in results if r[5] != float('inf')]
+
+  print(f"\nSampled {len(results)} images")
+  print(f"Exact path: {exact_total:.2f} s, fast path: {fast_total:.2f} s, speed-up {exact_total / fast_total:.2f}x")
+  if scores:
+    print(f"PSNR (dB): min {min(scores):.2f}, median {median(scores):.2f}, mean {mean(scores):.2f}")
+  else:
+    print("PSNR: outputs are identical")
+
+if __name__ == "__main__":
+  main()
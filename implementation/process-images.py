@@ -1,9 +1,28 @@
 import os
+import math
 import shutil
-from PIL import Image
+from PIL import Image, ImageChops, ImageStat
 import sys
 import json
 import random
+import hashlib
+import multiprocessing
+import queue
+import threading
+import importlib.util
+from io import BytesIO
+from collections import Counter
+import numpy as np
+
+def load_script(path, name):
+  spec = importlib.util.spec_from_file_location(name, path)
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  spec.loader.exec_module(module)
+  return module
+
+calc_waste = load_script('waste/calc-waste.py', 'calc_waste')
+calc_pruner = load_script('waste/calc-pruner.py', 'calc_pruner')
 
 methods = ['benchmark', 'picture-3', 'picture-5', 'srcset-3', 'srcset-5', 'pruner']
 image_sizes = {
@@ -15,40 +34,272 @@ image_sizes = {
   'pruner': [(1920, 1080)]
 }
 
+def load_image_sizes(sizes_path='implementation/assets/image-sizes.json'):
+  if not os.path.exists(sizes_path):
+    return {}
+  with open(sizes_path, 'r') as f:
+    return {method: [tuple(size) for size in sizes] for method, sizes in json.load(f).items()}
+
+extra_image_sizes = load_image_sizes()
+image_sizes.update(extra_image_sizes)
+methods += [method for method in extra_image_sizes if method not in methods]
+
+pruner_grid = calc_waste.get_pruner_grid()
+webp_quality = 80
+webp_method = 4
+encode_target = None
+webp_methods = [4]
+quality_range = (30, 95)
+quality_cache_folder = 'implementation/cache/quality'
+build_version = 2
+fast_resample = True
+reducing_gap = 3.0
+streaming_tiles = False
+memory_budget_mb = 512
+tile_pack = False
+visibility_index = True
+source_extensions = ['.jpg', '.jpeg', '.png', '.webp']
+workers = os.cpu_count() or 1
+name_seed = 0
+tile_threads = 1 if workers > 1 else (os.cpu_count() or 1)
+tile_queue_size = 2
+dedupe_mode = None
+store_folder_name = '.store'
+store_folder = None
+
 with open('implementation/assets/keywords.json', 'r') as f:
   data = json.load(f)
   keywords = data['keywords']
 
-def generate_random_filename(keywords, num_words=3):
-  random_words = random.sample(keywords, num_words)
+def generate_random_filename(keywords, num_words=3, rng=random):
+  random_words = rng.sample(keywords, num_words)
   return '-'.join(random_words).lower()
 
-def resize_and_crop_image(image_path, target_width, target_height, output_path):
+def cover_geometry(img_width, img_height, target_width, target_height):
+  aspect_ratio = img_width / img_height
+  target_aspect_ratio = target_width / target_height
+
+  if aspect_ratio > target_aspect_ratio:
+    new_height = target_height
+    new_width = int(new_height * aspect_ratio)
+  else:
+    new_width = target_width
+    new_height = int(new_width / aspect_ratio)
+
+  left = (new_width - target_width) // 2
+  top = (new_height - target_height) // 2
+  right = left + target_width
+  bottom = top + target_height
+
+  return (new_width, new_height), (left, top, right, bottom)
+
+def source_size_for(img_size, sizes):
+  img_width, img_height = img_size
+  scale = max(max(int(width * 2) / img_width, int(height * 2) / img_height) for width, height in sizes)
+  return math.ceil(img_width * scale), math.ceil(img_height * scale)
+
+def open_source(image_path, sizes, fast=None):
+  fast = fast_resample if fast is None else fast
+  img = Image.open(image_path)
+  if fast and img.format == 'JPEG':
+    img.draft(None, source_size_for(img.size, sizes))
+  return img
+
+def resize_and_crop(img, target_width, target_height, fast=None):
+  fast = fast_resample if fast is None else fast
   target_width = int(target_width * 2)
   target_height = int(target_height * 2)
 
-  with Image.open(image_path) as img:
-    img_width, img_height = img.size
-    aspect_ratio = img_width / img_height
-    target_aspect_ratio = target_width / target_height
+  new_size, crop_box = cover_geometry(img.width, img.height, target_width, target_height)
+  img_resized = img.resize(new_size, Image.LANCZOS, reducing_gap=reducing_gap if fast else None)
+  return img_resized.crop(crop_box)
 
-    if aspect_ratio > target_aspect_ratio:
-      new_height = target_height
-      new_width = int(new_height * aspect_ratio)
-    else:
-      new_width = target_width
-      new_height = int(new_width / aspect_ratio)
+def resize_region(img, target_width, target_height, region, fast=None):
+  fast = fast_resample if fast is None else fast
+  target_width = int(target_width * 2)
+  target_height = int(target_height * 2)
 
-    img_resized = img.resize((new_width, new_height), Image.LANCZOS)
-    left = (img_resized.width - target_width) // 2
-    top = (img_resized.height - target_height) // 2
-    right = left + target_width
-    bottom = top + target_height
+  (new_width, new_height), (crop_left, crop_top, _, _) = cover_geometry(img.width, img.height, target_width, target_height)
+  scale_x = img.width / new_width
+  scale_y = img.height / new_height
+
+  left, top, right, bottom = region
+  source_box = (
+    (crop_left + left) * scale_x,
+    (crop_top + top) * scale_y,
+    (crop_left + right) * scale_x,
+    (crop_top + bottom) * scale_y
+  )
+  return img.resize((right - left, bottom - top), Image.LANCZOS, box=source_box, reducing_gap=reducing_gap if fast else None)
+
+def render_derivative(img, target_width, target_height):
+  if streaming_tiles:
+    return resize_region(img, target_width, target_height, (0, 0, int(target_width * 2), int(target_height * 2)))
+  return resize_and_crop(img, target_width, target_height)
+
+def psnr(reference, candidate):
+  diff = ImageChops.difference(reference.convert('RGB'), candidate.convert('RGB'))
+  mse = sum(rms * rms for rms in ImageStat.Stat(diff).rms) / 3
+  return float('inf') if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+def gaussian_filter(pixels, size=11, sigma=1.5):
+  # Separable Gaussian over the positions where the whole window fits, as in the reference SSIM.
+  offsets = np.arange(size) - size // 2
+  window = np.exp(-offsets ** 2 / (2 * sigma ** 2))
+  window /= window.sum()
+  height, width = pixels.shape
+  rows = sum(weight * pixels[i:height - size + 1 + i] for i, weight in enumerate(window))
+  return sum(weight * rows[:, i:width - size + 1 + i] for i, weight in enumerate(window))
+
+def ssim(reference, candidate):
+  # Mean SSIM on luminance. Large images are first reduced so that the shorter side is about
+  # 256px, which keeps the 11px window at the scale the metric was calibrated for.
+  factor = max(1, round(min(reference.size) / 256))
+  x, y = (np.asarray(img.convert('L').reduce(factor), dtype=np.float64) for img in (reference, candidate))
+  c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+
+  mu_x, mu_y = gaussian_filter(x), gaussian_filter(y)
+  var_x = gaussian_filter(x * x) - mu_x ** 2
+  var_y = gaussian_filter(y * y) - mu_y ** 2
+  covariance = gaussian_filter(x * y) - mu_x * mu_y
+
+  ssim_map = (2 * mu_x * mu_y + c1) * (2 * covariance + c2) / ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+  return float(ssim_map.mean())
+
+quality_metrics = {'psnr': psnr, 'ssim': ssim}
+
+def webp_bytes(img, quality, method):
+  buffer = BytesIO()
+  img.save(buffer, format="WebP", quality=quality, method=method)
+  return buffer.getvalue()
+
+def meets_target(img, data):
+  for name, metric in quality_metrics.items():
+    if name in encode_target:
+      with Image.open(BytesIO(data)) as decoded:
+        return metric(img, decoded) >= encode_target[name]
+  return len(data) * 8 <= encode_target['bpp'] * img.width * img.height
+
+def search_quality(img, method):
+  low, high = quality_range
+  lower_is_better = 'bpp' not in encode_target
+  best = None
+
+  while low <= high:
+    quality = (low + high) // 2
+    data = webp_bytes(img, quality, method)
+
+    if meets_target(img, data):
+      best = (quality, data)
+      if lower_is_better:
+        high = quality - 1
+      else:
+        low = quality + 1
+    elif lower_is_better:
+      low = quality + 1
+    else:
+      high = quality - 1
+
+  if best:
+    return best
+
+  fallback = quality_range[1] if lower_is_better else quality_range[0]
+  return fallback, webp_bytes(img, fallback, method)
+
+def encoding_key(img):
+  sha = hashlib.sha256(json.dumps([img.mode, img.size, encode_target, webp_methods, quality_range]).encode())
+  sha.update(img.tobytes())
+  return sha.hexdigest()
+
+def load_encoding(key):
+  try:
+    with open(os.path.join(quality_cache_folder, key[:2], f"{key}.json"), 'r') as f:
+      return json.load(f)
+  except (FileNotFoundError, json.JSONDecodeError):
+    return None
+
+def save_encoding(key, encoding):
+  cache_folder = os.path.join(quality_cache_folder, key[:2])
+  os.makedirs(cache_folder, exist_ok=True)
+  replace_file(os.path.join(cache_folder, f"{key}.json"), lambda temp_path: write_bytes(temp_path, json.dumps(encoding).encode()))
+
+def encode_webp(img):
+  if not encode_target:
+    return webp_bytes(img, webp_quality, webp_method)
+
+  key = encoding_key(img)
+  cached = load_encoding(key)
+  if cached:
+    return webp_bytes(img, cached['quality'], cached['method'])
+
+  best = None
+  for method in webp_methods:
+    quality, data = search_quality(img, method)
+    if best is None or len(data) < len(best[2]):
+      best = (quality, method, data)
+
+  save_encoding(key, {'quality': best[0], 'method': best[1], 'bytes': len(best[2])})
+  return best[2]
+
+def replace_file(output_path, write):
+  temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+  try:
+    write(temp_path)
+    os.replace(temp_path, output_path)
+  finally:
+    if os.path.lexists(temp_path):
+      os.remove(temp_path)
+
+def write_bytes(path, data):
+  with open(path, 'wb') as f:
+    f.write(data)
+
+def store_blob(data, extension):
+  digest = hashlib.sha256(data).hexdigest()
+  blob_folder = os.path.join(store_folder, digest[:2])
+  blob_path = os.path.join(blob_folder, digest + extension)
+
+  if not os.path.exists(blob_path):
+    os.makedirs(blob_folder, exist_ok=True)
+    replace_file(blob_path, lambda temp_path: write_bytes(temp_path, data))
+  return blob_path
+
+def link_blob(blob_path, temp_path):
+  if dedupe_mode == 'symlink':
+    os.symlink(os.path.relpath(blob_path, os.path.dirname(temp_path)), temp_path)
+    return
+
+  try:
+    os.link(blob_path, temp_path)
+  except OSError:
+    shutil.copyfile(blob_path, temp_path)
+
+def write_output(output_path, data):
+  if not dedupe_mode or store_folder is None:
+    replace_file(output_path, lambda temp_path: write_bytes(temp_path, data))
+    return
+
+  blob_path = store_blob(data, os.path.splitext(output_path)[1])
+  replace_file(output_path, lambda temp_path: link_blob(blob_path, temp_path))
+
+def save_webp(img, output_path):
+  data = encode_webp(img)
+  write_output(output_path, data)
+  return len(data)
+
+def artifact(path, role, size, dimensions=None):
+  width, height = dimensions or (None, None)
+  return {'path': path, 'role': role, 'width': width, 'height': height, 'bytes': size}
+
+def artifact_path(output):
+  return output if isinstance(output, str) else output['path']
 
-    cropped_img = img_resized.crop((left, top, right, bottom))
-    cropped_img.save(output_path, format="WebP", quality=80)
+def resize_and_crop_image(image_path, target_width, target_height, output_path):
+  with open_source(image_path, [(target_width, target_height)]) as img:
+    cropped_img = resize_and_crop(img, target_width, target_height)
+    save_webp(cropped_img, output_path)
 
-def generate_html(folder, method, output_folder, image_filename, columns, rows=None):
+def generate_html(folder, method, output_folder, image_filename, columns, rows=None, pack=None, index=None):
   method_folder_path = os.path.join(output_folder, folder, method)
   html_content = ""
 
@@ -80,8 +331,9 @@ img {{
 
 </html>"""
   
-  elif method in ['picture-3', 'picture-5']:
+  elif method.startswith('picture-'):
     breakpoints = image_sizes[method]
+    fallback_width = max(width for width, height in breakpoints)
     sources = '\n'.join([
       f'  <source srcset="{image_filename}-{width}w.webp" media="(max-width: {width}px)">'
       for width, height in breakpoints
@@ -98,7 +350,7 @@ img {{
 <body>
   <picture>
 {sources}
-    <img src="{image_filename}-1920w.webp" alt="{image_filename}">
+    <img src="{image_filename}-{fallback_width}w.webp" alt="{image_filename}">
   </picture>
 </body>
 
@@ -116,7 +368,7 @@ img {{
 
 </html>"""
   
-  elif method in ['srcset-3', 'srcset-5']:
+  elif method.startswith('srcset-'):
     sizes = image_sizes[method]
     srcset = ', '.join([f"{image_filename}-{size[0]}w.webp {size[0]}w" for size in sizes])
     sizes_attr = ', '.join([f"(max-width: {size[0]}px) {size[0]}px" for size in sizes]) + ", 1280px"
@@ -132,7 +384,7 @@ img {{
 
 <body>
   <img 
-    src="{image_filename}-{sizes[1][0]}w.webp" 
+    src="{image_filename}-{sizes[min(1, len(sizes) - 1)][0]}w.webp" 
     srcset="{srcset}" 
     alt="{image_filename}" 
     loading="lazy">
@@ -158,6 +410,16 @@ img {{
       "tile": f"{columns} {rows}",
       "path": ''
     }
+
+    if pack:
+      pruner_data["pack"] = {
+        "file": os.path.basename(pack['path']),
+        "size": f"{pack['width']} {pack['height']}",
+        "lengths": pack['lengths']
+      }
+
+    if index:
+      pruner_data["index"] = os.path.basename(index['path'])
     
     pruner_json = json.dumps(pruner_data)
     
@@ -191,51 +453,250 @@ img {{
 </html>"""
 
   html_file_path = os.path.join(method_folder_path, 'index.html')
-  with open(html_file_path, 'w') as f:
-    f.write(html_content)
+  replace_file(html_file_path, lambda temp_path: write_bytes(temp_path, html_content.encode('utf-8')))
+  return html_file_path
+
+def encode_tiles(img, jobs, threads, save=save_webp):
+  sizes = {}
+
+  if threads <= 1:
+    for box, tile_path in jobs:
+      sizes[tile_path] = save(img.crop(box), tile_path)
+    return sizes
+
+  pending = queue.Queue(maxsize=threads * tile_queue_size)
+  errors = []
+
+  def worker():
+    while True:
+      item = pending.get()
+      if item is None:
+        return
+      tile, tile_path = item
+      try:
+        sizes[tile_path] = save(tile, tile_path)
+      except Exception as e:
+        errors.append(e)
+
+  pool = [threading.Thread(target=worker, daemon=True) for _ in range(threads)]
+  for thread in pool:
+    thread.start()
+
+  try:
+    for box, tile_path in jobs:
+      if errors:
+        break
+      pending.put((img.crop(box), tile_path))
+  finally:
+    for _ in pool:
+      pending.put(None)
+    for thread in pool:
+      thread.join()
+
+  if errors:
+    raise errors[0]
+  return sizes
+
+def tile_artifacts(jobs, sizes):
+  return [
+    artifact(tile_path, 'image', sizes[tile_path], (right - left, bottom - top))
+    for (left, top, right, bottom), tile_path in jobs
+  ]
+
+def tile_writer(blobs):
+  if not tile_pack:
+    return save_webp
+
+  def keep(tile, tile_path):
+    blobs[tile_path] = encode_webp(tile)
+    return len(blobs[tile_path])
+
+  return keep
+
+def pack_tiles(pruner_folder_path, image_filename, jobs, blobs):
+  pack_path = os.path.join(pruner_folder_path, f"{image_filename}-tiles.bin")
+  data = [blobs[tile_path] for box, tile_path in jobs]
+  write_output(pack_path, b''.join(data))
+
+  left, top, right, bottom = jobs[0][0]
+  pack = artifact(pack_path, 'pack', sum(len(blob) for blob in data), (right - left, bottom - top))
+  pack['lengths'] = [len(blob) for blob in data]
+  return pack
+
+def tile_outputs(pruner_folder_path, image_filename, jobs, sizes, blobs):
+  if tile_pack:
+    return [pack_tiles(pruner_folder_path, image_filename, jobs, blobs)]
+  return tile_artifacts(jobs, sizes)
+
+def tile_jobs(pruner_folder_path, image_filename, columns, cell_width, cell_height, first_row, last_row):
+  jobs = []
+
+  for row in range(first_row, last_row):
+    for col in range(columns):
+      count = row * columns + col + 1
+      left = col * cell_width
+      top = (row - first_row) * cell_height
+      right = left + cell_width
+      bottom = top + cell_height
+
+      jobs.append(((left, top, right, bottom), os.path.join(pruner_folder_path, f"{image_filename}-{count}.webp")))
+
+  return jobs
+
+def copy_pruner_js(pruner_folder_path):
+  pruner_js_path = os.path.join(pruner_folder_path, 'pruner.min.js')
+  with open('implementation/assets/pruner.min.js', 'rb') as f:
+    data = f.read()
+  write_output(pruner_js_path, data)
+  return artifact(pruner_js_path, 'js', len(data))
+
+def write_visibility_index(pruner_folder_path, outputs, columns, rows):
+  pack = next((output for output in outputs if output['role'] == 'pack'), None)
+  if pack:
+    tile_width, tile_height = pack['width'], pack['height']
+    tile_bytes = pack['lengths']
+  else:
+    tiles = [output for output in outputs if output['role'] == 'image']
+    tile_width, tile_height = tiles[0]['width'], tiles[0]['height']
+    tile_bytes = [output['bytes'] for output in tiles]
+
+  buckets = {}
+  for viewport_width, viewport_height in calc_waste.get_common_viewport_sizes():
+    tiles = set(calc_pruner.pruner_visible_tiles(viewport_width, viewport_height, columns, rows, tile_width, tile_height))
+    # Pack pages carry the tile size in data-pruner; only single-file pages fetch tile 1 as a probe.
+    if not pack:
+      tiles.add(1)
+    buckets[f"{viewport_width}x{viewport_height}"] = {
+      'tiles': format(sum(1 << (tile - 1) for tile in tiles), 'x'),
+      'bytes': sum(tile_bytes[tile - 1] for tile in tiles)
+    }
+
+  index_path = os.path.join(pruner_folder_path, 'visibility.json')
+  data = json.dumps({'tile': f"{columns} {rows}", 'buckets': buckets}, separators=(',', ':')).encode()
+  write_output(index_path, data)
+  return artifact(index_path, 'index', len(data))
+
+def save_pruner_tiles(img_master, pruner_folder_path, columns, rows, image_filename):
+  width, height = img_master.size
+  cell_width = width // columns
+  cell_height = height // rows
+
+  os.makedirs(pruner_folder_path, exist_ok=True)
+  jobs = tile_jobs(pruner_folder_path, image_filename, columns, cell_width, cell_height, 0, rows)
+  blobs = {}
+  sizes = encode_tiles(img_master, jobs, tile_threads, tile_writer(blobs))
+
+  outputs = tile_outputs(pruner_folder_path, image_filename, jobs, sizes, blobs)
+  outputs.append(copy_pruner_js(pruner_folder_path))
+  return outputs
+
+def bytes_per_pixel(img):
+  return 1 if img.mode in ('1', 'L', 'P') else 4
+
+# Only the Pruner.js master can be resampled and encoded band by band. Every other derivative is
+# a single WebP, so it is rendered whole next to the decoded source; the budget cannot go below
+# that, and the workers say so once instead of quietly overrunning it.
+budget_warned = False
+
+def check_memory_budget(img, sizes):
+  global budget_warned
+  pixel_bytes = bytes_per_pixel(img)
+  source_bytes = img.width * img.height * pixel_bytes
+  derivative_bytes = max((int(width * 2) * int(height * 2) * pixel_bytes for width, height in sizes), default=0)
+  needed_mb = (source_bytes + derivative_bytes) / 1024 ** 2
+
+  if needed_mb > memory_budget_mb and not budget_warned:
+    budget_warned = True
+    largest = ' and the largest derivative' if derivative_bytes else ''
+    print(f"\nWarning: memory_budget_mb = {memory_budget_mb} is below the {needed_mb:.0f} MB needed for the decoded source{largest}; "
+          f"peak memory per worker will exceed the budget.")
+
+def rows_per_band(img, master_width, cell_height, columns, rows):
+  pixel_bytes = bytes_per_pixel(img)
+  source_bytes = img.width * img.height * pixel_bytes
+  queued_bytes = tile_threads * tile_queue_size * (master_width // columns) * cell_height * pixel_bytes
+  row_bytes = master_width * cell_height * pixel_bytes
+
+  available = memory_budget_mb * 1024 ** 2 - source_bytes - queued_bytes
+  return max(1, min(rows, available // row_bytes))
+
+def stream_pruner_tiles(img, pruner_folder_path, columns, rows, image_filename):
+  target_width, target_height = image_sizes['pruner'][0]
+  master_width = int(target_width * 2)
+  master_height = int(target_height * 2)
+  cell_width = master_width // columns
+  cell_height = master_height // rows
+
+  os.makedirs(pruner_folder_path, exist_ok=True)
+  band_rows = rows_per_band(img, master_width, cell_height, columns, rows)
+  all_jobs = []
+  sizes = {}
+  blobs = {}
+
+  for first_row in range(0, rows, band_rows):
+    last_row = min(rows, first_row + band_rows)
+    band = resize_region(img, target_width, target_height, (0, first_row * cell_height, master_width, last_row * cell_height))
+
+    jobs = tile_jobs(pruner_folder_path, image_filename, columns, cell_width, cell_height, first_row, last_row)
+    sizes.update(encode_tiles(band, jobs, tile_threads, tile_writer(blobs)))
+    all_jobs += jobs
+    del band
+
+  outputs = tile_outputs(pruner_folder_path, image_filename, all_jobs, sizes, blobs)
+  outputs.append(copy_pruner_js(pruner_folder_path))
+  return outputs
 
 def process_pruner_image(image_path, pruner_folder_path, columns, rows, image_filename):
-  target_width, target_height = 1920, 1080
-  target_width = int(target_width * 2)
-  target_height = int(target_height * 2)
+  target_width, target_height = image_sizes['pruner'][0]
 
-  with Image.open(image_path) as img:
-    img_width, img_height = img.size
-    aspect_ratio = img_width / img_height
-    target_aspect_ratio = target_width / target_height
+  with open_source(image_path, image_sizes['pruner']) as img:
+    img_master = resize_and_crop(img, target_width, target_height)
+    return save_pruner_tiles(img_master, pruner_folder_path, columns, rows, image_filename)
 
-    if aspect_ratio > target_aspect_ratio:
-      new_height = target_height
-      new_width = int(new_height * aspect_ratio)
-    else:
-      new_width = target_width
-      new_height = int(new_width / aspect_ratio)
+def derivative_filename(method, image_filename, width):
+  if method == 'benchmark':
+    return f"{image_filename}.webp"
+  return f"{image_filename}-{width}w.webp"
 
-    img_resized = img.resize((new_width, new_height), Image.LANCZOS)
+def plan_derivatives(methods):
+  plan = {}
+  for method in methods:
+    for size in image_sizes.get(method, []):
+      plan.setdefault(size, []).append(method)
+  return plan
 
-    left = (img_resized.width - target_width) // 2
-    top = (img_resized.height - target_height) // 2
-    right = left + target_width
-    bottom = top + target_height
+def process_derivatives(image_path, output_image_folder, image_filename, columns, rows, methods):
+  streamed = streaming_tiles and 'pruner' in methods
+  plan = plan_derivatives([method for method in methods if not (streamed and method == 'pruner')])
+  outputs = {method: [] for method in methods}
 
-    img_resized = img_resized.crop((left, top, right, bottom))
+  with open_source(image_path, [size for method in methods for size in image_sizes.get(method, [])]) as img:
+    img.load()
 
-    width, height = img_resized.size
-    cell_width = width // columns
-    cell_height = height // rows
+    if streamed:
+      check_memory_budget(img, list(plan))
+      outputs['pruner'] += stream_pruner_tiles(img, os.path.join(output_image_folder, 'pruner'), columns, rows, image_filename)
 
-    os.makedirs(pruner_folder_path, exist_ok=True)
+    for (width, height), targets in plan.items():
+      derivative = render_derivative(img, width, height)
+      encoded = None
 
-    for count, (row, col) in enumerate(((r, c) for r in range(rows) for c in range(columns)), 1):
-      left = col * cell_width
-      top = row * cell_height
-      right = left + cell_width
-      bottom = top + cell_height
+      for method in targets:
+        method_folder_path = os.path.join(output_image_folder, method)
+
+        if method == 'pruner':
+          outputs[method] += save_pruner_tiles(derivative, method_folder_path, columns, rows, image_filename)
+          continue
 
-      cropped_image = img_resized.crop((left, top, right, bottom))
-      cropped_image.save(os.path.join(pruner_folder_path, f"{image_filename}-{count}.webp"), format="WebP", quality=80)
+        if encoded is None:
+          encoded = encode_webp(derivative)
+        output_path = os.path.join(method_folder_path, derivative_filename(method, image_filename, width))
+        write_output(output_path, encoded)
+        outputs[method].append(artifact(output_path, 'image', len(encoded), derivative.size))
 
-    shutil.copy('implementation/assets/pruner.min.js', pruner_folder_path)
+      del derivative, encoded
+
+  return outputs
 
 def print_progress_bar(iteration, total, bar_length=40):
   percent = ("{0:.1f}").format(100 * (iteration / float(total)))
@@ -244,55 +705,226 @@ def print_progress_bar(iteration, total, bar_length=40):
   sys.stdout.write(f'\r|{bar}| {percent}% Complete')
   sys.stdout.flush()
 
-def create_folders_and_html(target_folder, num_images, output_folder):
-  valid_extensions = ['.jpg', '.jpeg', '.png', '.webp']
-  images = [f for f in os.listdir(target_folder) if any(f.lower().endswith(ext) for ext in valid_extensions)]
+def file_hash(path):
+  sha = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      sha.update(chunk)
+  return sha.hexdigest()
+
+def method_config(method):
+  config = {
+    'version': build_version,
+    'sizes': image_sizes.get(method, []),
+    'encoding': [webp_quality, webp_method, encode_target, webp_methods, quality_range],
+    'resample': [fast_resample, reducing_gap],
+    'streaming': streaming_tiles
+  }
+  if dedupe_mode:
+    config['dedupe'] = dedupe_mode
+  if method == 'pruner':
+    config['grid'] = pruner_grid
+    config['pack'] = tile_pack
+    config['index'] = visibility_index
+  return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+def load_manifest(manifest_path):
+  records = {}
+  if not os.path.exists(manifest_path):
+    return records
+
+  with open(manifest_path, 'r') as f:
+    for line in f:
+      try:
+        record = json.loads(line)
+      except json.JSONDecodeError:
+        continue
+      records[record['folder']] = record
+  return records
+
+def append_manifest(manifest_path, record):
+  with open(manifest_path, 'a') as f:
+    f.write(json.dumps(record) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
+
+def write_manifest(manifest_path, records):
+  temp_path = manifest_path + '.tmp'
+  with open(temp_path, 'w') as f:
+    for folder in sorted(records):
+      f.write(json.dumps(records[folder]) + '\n')
+  os.replace(temp_path, manifest_path)
+
+def source_stem(source):
+  root, extension = os.path.splitext(os.path.basename(source))
+  return root if extension.lower() in source_extensions else os.path.basename(source)
+
+def load_folder_map(output_folder, manifest):
+  map_path = os.path.join(output_folder, 'folders.json')
+  if os.path.exists(map_path):
+    with open(map_path, 'r') as f:
+      return json.load(f)
+  return {source_stem(record['source']): folder for folder, record in manifest.items()}
+
+def save_folder_map(output_folder, folder_map):
+  map_path = os.path.join(output_folder, 'folders.json')
+  replace_file(map_path, lambda temp_path: write_bytes(temp_path, json.dumps(folder_map, indent=2, sort_keys=True).encode()))
+
+def assign_folder(folder_map, source):
+  stem = source_stem(source)
+  if stem not in folder_map:
+    folder_map[stem] = str(max((int(folder) for folder in folder_map.values()), default=0) + 1).zfill(4)
+  return folder_map[stem]
+
+def stale_methods(previous, source_hash, image_name, output_folder):
+  if not previous or previous['source_hash'] != source_hash or previous['image_name'] != image_name:
+    return list(methods)
+
+  stale = []
+  for method in methods:
+    entry = previous['methods'].get(method)
+    if (not entry or entry['config'] != method_config(method)
+        or not all(os.path.exists(os.path.join(output_folder, artifact_path(output))) for output in entry['outputs'])):
+      stale.append(method)
+  return stale
+
+def remove_orphans(previous, record, output_folder):
+  if not previous:
+    return
+
+  for method, entry in previous['methods'].items():
+    current = set(artifact_path(output) for output in record['methods'].get(method, {}).get('outputs', []))
+    for path in map(artifact_path, entry['outputs']):
+      if path not in current:
+        try:
+          os.remove(os.path.join(output_folder, path))
+        except FileNotFoundError:
+          pass
+
+def process_folder(task):
+  global store_folder
+  folder, image_path, output_folder, previous = task
+  store_folder = os.path.join(output_folder, store_folder_name)
+  output_image_folder = os.path.join(output_folder, folder)
+
+  rng = random.Random(f"{name_seed}:{folder}")
+  image_name = generate_random_filename(keywords, rng.randint(3, 5), rng)
+  columns, rows = pruner_grid
+
+  source_hash = file_hash(image_path)
+  stale = stale_methods(previous, source_hash, image_name, output_folder)
+  # Methods dropped from `methods`, such as breakpoint sets removed from image-sizes.json, have
+  # their outputs and manifest entries removed as well.
+  dropped = [method for method in previous['methods'] if method not in methods] if previous else []
+  if not stale and not dropped:
+    return previous, False
+
+  for method in stale:
+    os.makedirs(os.path.join(output_image_folder, method), exist_ok=True)
+
+  outputs = process_derivatives(image_path, output_image_folder, image_name, columns, rows, stale) if stale else {}
+  pack = next((output for output in outputs.get('pruner', []) if output['role'] == 'pack'), None)
+  index = None
+  if 'pruner' in stale and visibility_index:
+    index = write_visibility_index(os.path.join(output_image_folder, 'pruner'), outputs['pruner'], columns, rows)
+    outputs['pruner'].append(index)
+
+  for method in stale:
+    html_path = generate_html(folder, method, output_folder, image_name, columns, rows, pack if method == 'pruner' else None, index if method == 'pruner' else None)
+    outputs[method].append(artifact(html_path, 'html', os.path.getsize(html_path)))
+
+  record = {
+    'folder': folder,
+    'source': os.path.basename(image_path),
+    'source_hash': source_hash,
+    'image_name': image_name,
+    'methods': {}
+  }
+  for method in methods:
+    if method in stale:
+      record['methods'][method] = {
+        'config': method_config(method),
+        'outputs': [dict(output, path=os.path.relpath(output['path'], output_folder)) for output in outputs[method]]
+      }
+    else:
+      record['methods'][method] = previous['methods'][method]
+
+  remove_orphans(previous, record, output_folder)
+  for method in dropped:
+    shutil.rmtree(os.path.join(output_image_folder, method), ignore_errors=True)
+  return record, True
+
+def dedupe_usage(manifest, output_folder):
+  usage = Counter()
+  blobs = set()
+
+  for record in manifest.values():
+    for entry in record['methods'].values():
+      for output in entry['outputs']:
+        path = os.path.join(output_folder, output['path'])
+        if not os.path.exists(path):
+          continue
+        stat = os.stat(path)
+        usage['files'] += 1
+        usage['bytes'] += stat.st_size
+        if (stat.st_dev, stat.st_ino) not in blobs:
+          blobs.add((stat.st_dev, stat.st_ino))
+          usage['blobs'] += 1
+          usage['blob_bytes'] += stat.st_size
+  return usage
+
+def create_folders_and_html(target_folder, num_images, output_folder, workers=1):
+  os.makedirs(output_folder, exist_ok=True)
+  manifest_path = os.path.join(output_folder, 'manifest.jsonl')
+  manifest = load_manifest(manifest_path)
+
+  images = sorted(f for f in os.listdir(target_folder) if any(f.lower().endswith(ext) for ext in source_extensions))
   
   print(f"Found {len(images)} images in {target_folder}")
   
   images_to_process = images[:num_images]
-  print(f"Processing {len(images_to_process)} images.")
-
-  total_steps = len(images_to_process) * len(methods)
-  current_step = 0
+  print(f"Processing {len(images_to_process)} images with {workers} worker(s).")
 
-  for i, image_filename in enumerate(images_to_process, start=1):
-    folder = str(i).zfill(4)
-    output_image_folder = os.path.join(output_folder, folder)
-    os.makedirs(output_image_folder, exist_ok=True)
+  folder_map = load_folder_map(output_folder, manifest)
+  folders = [assign_folder(folder_map, image_filename) for image_filename in images_to_process]
+  save_folder_map(output_folder, folder_map)
 
-    image_name = generate_random_filename(keywords, random.randint(3, 5))
-    columns = 14
-    rows = 6
-
-    for method in methods:
-      method_folder_path = os.path.join(output_image_folder, method)
-      os.makedirs(method_folder_path, exist_ok=True)
-
-      image_path = os.path.join(target_folder, image_filename)
-
-      if method == 'benchmark':
-        benchmark_image_path = os.path.join(method_folder_path, f"{image_name}.webp")
-        resize_and_crop_image(image_path, 1920, 1080, benchmark_image_path)
-      elif method != 'pruner':
-        for width, height in image_sizes.get(method, []):
-          resized_image_path = os.path.join(method_folder_path, f"{image_name}-{width}w.webp")
-          resize_and_crop_image(image_path, width, height, resized_image_path)
-
-      if method == 'pruner':
-        pruner_folder_path = os.path.join(output_image_folder, 'pruner')
-        process_pruner_image(image_path, pruner_folder_path, columns, rows, image_name)
+  tasks = [
+    (folder, os.path.join(target_folder, image_filename), output_folder, manifest.get(folder))
+    for folder, image_filename in zip(folders, images_to_process)
+  ]
 
+  total_steps = len(tasks)
+  current_step = 0
+  rebuilt = 0
+
+  pool = multiprocessing.Pool(workers) if workers > 1 else None
+  try:
+    results = pool.imap_unordered(process_folder, tasks) if pool else map(process_folder, tasks)
+    for record, built in results:
+      if built:
+        manifest[record['folder']] = record
+        append_manifest(manifest_path, record)
+        rebuilt += 1
       current_step += 1
       print_progress_bar(current_step, total_steps)
-
-    for method in methods:
-      generate_html(folder, method, output_folder, image_name, columns, rows)
-
-  print("\nAll images processed successfully.")
-
-target_folder = 'implementation/target'
-output_folder = 'implementation/processed'
-num_images = 1000
-
-create_folders_and_html(target_folder, num_images, output_folder)
\ No newline at end of file
+  finally:
+    if pool:
+      pool.close()
+      pool.join()
+    write_manifest(manifest_path, manifest)
+
+  print(f"\nAll images processed successfully ({rebuilt} rebuilt, {len(tasks) - rebuilt} up to date).")
+
+  usage = dedupe_usage(manifest, output_folder) if dedupe_mode else None
+  if usage and usage['files']:
+    saved = usage['bytes'] - usage['blob_bytes']
+    print(f"Dedupe: {usage['files']} files ({usage['bytes'] / 1024 ** 2:.2f} MB) share {usage['blobs']} stored blobs "
+          f"({usage['blob_bytes'] / 1024 ** 2:.2f} MB), saving {saved / 1024 ** 2:.2f} MB ({saved / usage['bytes'] * 100:.1f}%)")
+
+if __name__ == "__main__":
+  target_folder = 'implementation/target'
+  output_folder = 'implementation/processed'
+  num_images = 1000
+
+  create_folders_and_html(target_folder, num_images, output_folder, workers)
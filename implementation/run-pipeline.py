@@ -0,0 +1,157 @@
+import os
+import sys
+import csv
+import time
+import threading
+import importlib.util
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+def load_script(path, name):
+  spec = importlib.util.spec_from_file_location(name, path)
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  spec.loader.exec_module(module)
+  return module
+
+get_flickr = load_script('dataset/get-flickr.py', 'get_flickr')
+process_images = load_script('implementation/process-images.py', 'process_images')
+
+def read_rows(csv_filename):
+  with open(csv_filename, mode='r', encoding='utf-8') as file:
+    reader = csv.reader(file)
+    next(reader)
+    return list(reader)
+
+def run_pipeline(csv_filename, target_folder, output_folder, max_images, download_workers, process_workers, queue_size):
+  os.makedirs(output_folder, exist_ok=True)
+  manifest_path = os.path.join(output_folder, 'manifest.jsonl')
+  manifest = process_images.load_manifest(manifest_path)
+  folder_map = process_images.load_folder_map(output_folder, manifest)
+
+  ledger_path = os.path.join(os.path.dirname(csv_filename), get_flickr.ledger_filename)
+  ledger = get_flickr.load_ledger(ledger_path)
+  session = get_flickr.make_session(download_workers)
+  limiter = get_flickr.RateLimiter(get_flickr.requests_per_second)
+
+  rows = list(get_flickr.unique_targets(read_rows(csv_filename), target_folder))
+  state = threading.Condition()
+  counts = Counter()
+  failed_downloads = []
+
+  # The bar is sized by the images handed to processing so far, so failed downloads do not keep
+  # it short of 100%.
+  def progress():
+    process_images.print_progress_bar(counts['processed'] + counts['failed'], counts['downloaded'])
+
+  # The process pool is a ProcessPoolExecutor rather than a multiprocessing.Pool: when a worker
+  # dies, for example killed for running out of memory, its futures fail with BrokenProcessPool
+  # instead of never calling back, so the final wait cannot hang.
+  def processed(future):
+    try:
+      record, built = future.result()
+    except Exception as e:
+      failed(e)
+      return
+
+    with state:
+      if built:
+        manifest[record['folder']] = record
+        process_images.append_manifest(manifest_path, record)
+        counts['rebuilt'] += 1
+      counts['processed'] += 1
+      counts['queued'] -= 1
+      progress()
+      state.notify_all()
+
+  def failed(error):
+    with state:
+      print(f"\nProcessing failed: {error}")
+      counts['failed'] += 1
+      counts['queued'] -= 1
+      progress()
+      state.notify_all()
+
+  def downloaded(row, future):
+    image_path = None
+    try:
+      if future.result() is not None:
+        image_path = get_flickr.existing_image(get_flickr.image_stem(target_folder, row[1]))
+    except Exception as e:
+      print(f"\nDownload of '{row[1]}' failed: {e}")
+    finally:
+      with state:
+        counts['downloading'] -= 1
+        if image_path:
+          # Folders come from the same persisted source map as process-images.py, so either entry
+          # point can rebuild a tree made by the other without renumbering it. Only images that
+          # arrived get a number, so failed downloads leave no gaps.
+          folder = process_images.assign_folder(folder_map, row[1].replace('/', '_'))
+          process_images.save_folder_map(output_folder, folder_map)
+          counts['downloaded'] += 1
+          counts['queued'] += 1
+          try:
+            pool.submit(process_images.process_folder, (folder, image_path, output_folder, manifest.get(folder))).add_done_callback(processed)
+          except Exception as e:
+            print(f"\nProcessing of '{row[1]}' could not start: {e}")
+            counts['failed'] += 1
+            counts['queued'] -= 1
+        else:
+          failed_downloads.append((row[0], row[1]))
+        state.notify_all()
+
+  # An image holds a slot from the start of its download until it is processed. When processing
+  # falls behind, every slot fills up and no new download starts until a worker frees one.
+  def ready():
+    return (counts['downloading'] < download_workers and counts['downloading'] + counts['queued'] < queue_size
+            and counts['downloaded'] + counts['downloading'] < max_images)
+
+  start = time.perf_counter()
+  pool = ProcessPoolExecutor(process_workers)
+  try:
+    with ThreadPoolExecutor(max_workers=download_workers) as executor:
+      for row in rows:
+        with state:
+          state.wait_for(lambda: ready() or counts['downloaded'] >= max_images)
+          if counts['downloaded'] >= max_images:
+            break
+          counts['downloading'] += 1
+
+        expected_size = (int(row[2]), int(row[3])) if row[2].isdigit() and row[3].isdigit() else None
+        future = executor.submit(get_flickr.download_and_save_image, row[0], row[1], target_folder, session=session, limiter=limiter,
+                                 expected_size=expected_size, ledger_path=ledger_path, ledger=ledger)
+        future.add_done_callback(lambda future, row=row: downloaded(row, future))
+
+      with state:
+        state.wait_for(lambda: counts['downloading'] == 0)
+      download_time = time.perf_counter() - start
+
+    with state:
+      state.wait_for(lambda: counts['queued'] == 0)
+  finally:
+    pool.shutdown()
+    process_images.write_manifest(manifest_path, manifest)
+    get_flickr.write_ledger(ledger_path, ledger)
+
+  print(f"\nPipeline finished in {time.perf_counter() - start:.1f} s (downloads done after {download_time:.1f} s): "
+        f"{counts['processed']} images processed ({counts['rebuilt']} rebuilt), {counts['failed']} failed to process, "
+        f"{len(failed_downloads)} downloads failed.")
+  return failed_downloads
+
+def main():
+  csv_filename = 'dataset/dataset.csv'
+  target_folder = 'implementation/target'
+  output_folder = 'implementation/processed'
+  max_images = 1000
+  download_workers = get_flickr.download_workers
+  process_workers = process_images.workers
+  queue_size = 2 * process_workers
+
+  if not os.path.exists(csv_filename):
+    print("CSV file not found. Run get-flickr.py to create it first.")
+    return
+
+  run_pipeline(csv_filename, target_folder, output_folder, max_images, download_workers, process_workers, queue_size)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,184 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import contextlib
+import importlib.util
+from statistics import median
+import numpy as np
+import PIL
+from PIL import Image
+
+def load_script(path, name):
+  spec = importlib.util.spec_from_file_location(name, path)
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  spec.loader.exec_module(module)
+  return module
+
+process_images = load_script('implementation/process-images.py', 'process_images')
+calc_results = load_script('implementation/calc-results.py', 'calc_results')
+calc_waste = calc_results.calc_waste
+calc_pruner = calc_results.calc_pruner
+
+def synthetic_image(kind, width, height, seed=0):
+  rng = np.random.RandomState(seed)
+
+  if kind == 'flat':
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[:] = (64, 128, 192)
+  elif kind == 'noisy':
+    pixels = rng.randint(0, 256, (height, width, 3), dtype=np.uint8)
+  else:
+    # Smooth gradients with a few soft blobs and mild sensor noise, standing in for a photograph.
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channels = [x / width, y / height, 1 - (x + y) / (width + height)]
+    for _ in range(6):
+      cx, cy, r = rng.rand() * width, rng.rand() * height, (0.05 + rng.rand() * 0.2) * width
+      blob = np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * r ** 2))
+      channels = [c + blob * rng.uniform(-0.5, 0.5) for c in channels]
+    pixels = np.stack(channels, axis=-1) * 255 + rng.normal(0, 4, (height, width, 3))
+    pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+
+  return Image.fromarray(pixels, 'RGB')
+
+def make_fixtures(fixture_folder, kinds, sizes):
+  fixtures = {}
+  for kind in kinds:
+    for width, height in sizes:
+      path = os.path.join(fixture_folder, f"{kind}-{width}x{height}.jpg")
+      synthetic_image(kind, width, height).save(path, quality=90)
+      fixtures[(kind, width, height)] = path
+  return fixtures
+
+def measure(function, repeats, min_sample_time=0.05):
+  # Fast functions are looped so that each sample lasts at least min_sample_time; the result is
+  # the median time per call.
+  loops = 1
+  timings = []
+  with contextlib.redirect_stdout(io.StringIO()):
+    while len(timings) < repeats:
+      start = time.perf_counter()
+      for _ in range(loops):
+        function()
+      elapsed = time.perf_counter() - start
+      if elapsed < min_sample_time and not timings:
+        loops = max(loops * 2, int(loops * min_sample_time / max(elapsed, 1e-9)) + 1)
+        continue
+      timings.append(elapsed / loops)
+  return median(timings)
+
+def build_benchmarks(fixtures, work_folder, grids):
+  benchmarks = {}
+
+  for (kind, width, height), path in fixtures.items():
+    name = f"{kind}-{width}x{height}"
+    benchmarks[f"resize_and_crop_image[{name}]"] = lambda path=path: process_images.resize_and_crop_image(
+      path, 1920, 1080, os.path.join(work_folder, 'resized.webp'))
+
+    if kind == 'photo':
+      for columns, rows in grids:
+        benchmarks[f"process_pruner_image[{name},{columns}x{rows}]"] = lambda path=path, columns=columns, rows=rows: process_images.process_pruner_image(
+          path, os.path.join(work_folder, 'pruner'), columns, rows, 'bench')
+
+  def generate_pages():
+    for method in process_images.methods:
+      os.makedirs(os.path.join(work_folder, 'html', method), exist_ok=True)
+      process_images.generate_html('html', method, work_folder, 'bench', 14, 6)
+
+  benchmarks['generate_html'] = generate_pages
+  benchmarks['optimal_tile_size'] = lambda: calc_pruner.optimal_tile_size(
+    1920, 1080, calc_pruner.get_priority_viewport_sizes(), calc_pruner.get_secondary_viewport_sizes())
+  benchmarks['calculate_pixel_waste'] = lambda: [
+    calc_waste.calculate_pixel_waste(breakpoints, calc_waste.get_common_viewport_sizes())
+    for breakpoints in (calc_waste.get_three_breakpoint(), calc_waste.get_five_breakpoint())
+  ]
+  return benchmarks
+
+def build_tree(fixtures, output_folder, count):
+  paths = [path for (kind, width, height), path in sorted(fixtures.items()) if kind == 'photo']
+  with contextlib.redirect_stdout(io.StringIO()):
+    for i in range(count):
+      process_images.process_folder((str(i + 1).zfill(4), paths[i % len(paths)], output_folder, None))
+
+def load_history(history_path):
+  if not os.path.exists(history_path):
+    return []
+  with open(history_path, 'r') as f:
+    return json.load(f)
+
+def save_history(history_path, history):
+  temp_path = history_path + '.tmp'
+  with open(temp_path, 'w') as f:
+    json.dump(history, f, indent=2)
+  os.replace(temp_path, history_path)
+
+def find_regressions(history, results, machine, baseline_runs, threshold):
+  previous = [run for run in history if run['machine'] == machine][-baseline_runs:]
+  regressions = {}
+
+  for name, seconds in results.items():
+    timings = [run['results'][name] for run in previous if name in run['results']]
+    if not timings:
+      continue
+    baseline = median(timings)
+    if seconds > baseline * (1 + threshold):
+      regressions[name] = (baseline, seconds)
+  return regressions
+
+def run_benchmarks(repeats, grids, tree_folders):
+  work_folder = tempfile.mkdtemp(prefix='pruner-bench-')
+  try:
+    fixtures = make_fixtures(work_folder, ['flat', 'noisy', 'photo'], [(1600, 1000), (4000, 2500)])
+    benchmarks = build_benchmarks(fixtures, work_folder, grids)
+
+    tree_folder = os.path.join(work_folder, 'processed')
+    build_tree(fixtures, tree_folder, tree_folders)
+    benchmarks['calc_results_tree_scan'] = lambda: list(calc_results.iter_folder_sizes(tree_folder))
+
+    results = {}
+    for name, function in benchmarks.items():
+      results[name] = measure(function, repeats)
+      print(f"{name}: {results[name] * 1000:.1f} ms")
+    return results
+  finally:
+    shutil.rmtree(work_folder, ignore_errors=True)
+
+def main():
+  history_path = 'performance/bench-history.json'
+  repeats = 5
+  grids = [(14, 6), (16, 7), (9, 5)]
+  tree_folders = 4
+  baseline_runs = 5
+  threshold = 0.25
+
+  machine = f"{platform.node()} {platform.machine()} {os.cpu_count()} CPUs"
+  print(f"Benchmarking on {machine}, Python {platform.python_version()}, Pillow {PIL.__version__}, NumPy {np.__version__}\n")
+  results = run_benchmarks(repeats, grids, tree_folders)
+
+  history = load_history(history_path)
+  regressions = find_regressions(history, results, machine, baseline_runs, threshold)
+  history.append({
+    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'machine': machine,
+    'python': platform.python_version(),
+    'pillow': PIL.__version__,
+    'numpy': np.__version__,
+    'results': results
+  })
+  save_history(history_path, history)
+
+  if regressions:
+    print(f"\n{len(regressions)} benchmark(s) regressed by more than {threshold * 100:.0f}%:")
+    for name, (baseline, seconds) in regressions.items():
+      print(f"{name}: {baseline * 1000:.1f} ms -> {seconds * 1000:.1f} ms ({(seconds / baseline - 1) * 100:+.0f}%)")
+    sys.exit(1)
+
+  print(f"\nNo regressions against the last {baseline_runs} runs on this machine. History saved to {history_path}")
+
+if __name__ == "__main__":
+  main()
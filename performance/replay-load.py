@@ -0,0 +1,217 @@
+import os
+import re
+import sys
+import time
+import threading
+import http.client
+import importlib.util
+from io import BytesIO
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+def load_script(path, name):
+  spec = importlib.util.spec_from_file_location(name, path)
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  spec.loader.exec_module(module)
+  return module
+
+# The scripts load each other, and read their inputs, by paths relative to the repository root,
+# so run from there whatever the working directory.
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+calc_results = load_script('implementation/calc-results.py', 'calc_results')
+
+class ShapedHandler(SimpleHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  # Headers and body go out in separate writes. With Nagle on, the body waits for the client's
+  # delayed ACK, which adds tens of milliseconds per request and swamps the injected RTT.
+  disable_nagle_algorithm = True
+
+  def setup(self):
+    super().setup()
+    time.sleep(self.server.rtt)
+
+  def send_head(self):
+    time.sleep(self.server.rtt)
+    match = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+    if not match:
+      return super().send_head()
+
+    try:
+      f = open(self.translate_path(self.path), 'rb')
+    except OSError:
+      self.send_error(404)
+      return None
+
+    with f:
+      size = os.fstat(f.fileno()).st_size
+      start, end = int(match.group(1)), min(int(match.group(2)), size - 1)
+      if start > end:
+        self.send_error(416)
+        return None
+      f.seek(start)
+      body = f.read(end - start + 1)
+
+    self.send_response(206)
+    self.send_header('Content-Type', 'application/octet-stream')
+    self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    return BytesIO(body)
+
+  def copyfile(self, source, outputfile):
+    while True:
+      chunk = source.read(self.server.chunk_size)
+      if not chunk:
+        break
+      throttle(self.server, len(chunk))
+      outputfile.write(chunk)
+
+  def log_message(self, format, *args):
+    pass
+
+def throttle(server, size):
+  if not server.bandwidth:
+    return
+  with server.link_lock:
+    now = time.monotonic()
+    start = max(now, server.link_free_at)
+    server.link_free_at = start + size / server.bandwidth
+    wait = server.link_free_at - now
+  time.sleep(wait)
+
+def start_server(directory, rtt, bandwidth, chunk_size=16384):
+  server = ThreadingHTTPServer(('127.0.0.1', 0), partial(ShapedHandler, directory=directory))
+  server.daemon_threads = True
+  server.rtt = rtt
+  server.bandwidth = bandwidth
+  server.chunk_size = chunk_size
+  server.link_lock = threading.Lock()
+  server.link_free_at = 0.0
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server
+
+def request_stages(page, viewport_width, viewport_height, density, artifacts):
+  if 'data-pruner' in page.img:
+    tiles = calc_results.select_pruner_tiles(page, viewport_width, viewport_height, artifacts)
+    if '#bytes=' in tiles[0]:
+      return [['index.html'], page.scripts, tiles]
+    return [['index.html'], page.scripts, tiles[:1], tiles[1:]]
+  return [['index.html'], calc_results.page_requests(page, viewport_width, viewport_height, density, artifacts)[1:]]
+
+def fetch(local, port, url, keep_alive):
+  path, _, byte_range = url.partition('#bytes=')
+  headers = {} if keep_alive else {'Connection': 'close'}
+  if byte_range:
+    headers['Range'] = f"bytes={byte_range}"
+
+  connection = getattr(local, 'connection', None)
+  if connection is None:
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    local.connection = connection
+
+  connection.request('GET', path, headers=headers)
+  response = connection.getresponse()
+  size = len(response.read())
+
+  if not keep_alive or response.will_close:
+    connection.close()
+    local.connection = None
+
+  # A range that comes back as 200 transfers the whole pack, so only the exact status counts.
+  expected = 206 if byte_range else 200
+  if response.status != expected:
+    return size, f"GET {url} returned {response.status} {response.reason}, expected {expected}"
+  return size, None
+
+def replay_page(executor, local, port, base_path, stages, keep_alive):
+  start = time.perf_counter()
+  transferred = 0
+  requests = 0
+  errors = []
+
+  for stage in stages:
+    if not stage:
+      continue
+    for size, error in executor.map(lambda url: fetch(local, port, f"{base_path}/{url}", keep_alive), stage):
+      transferred += size
+      if error:
+        errors.append(error)
+    requests += len(stage)
+
+  return time.perf_counter() - start, transferred, requests, errors
+
+def replay_methods(output_folder, folders, viewports, density, concurrency, keep_alive, rtt, bandwidth):
+  records = calc_results.read_manifest(os.path.join(output_folder, 'manifest.jsonl'))
+  server = start_server(output_folder, rtt, bandwidth)
+  port = server.server_address[1]
+  results = {}
+
+  try:
+    for method in calc_results.folder_types.values():
+      local = threading.local()
+      samples = []
+      method_start = time.perf_counter()
+
+      with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for folder_name in folders:
+          entry = records[folder_name]['methods'].get(method)
+          if not entry:
+            continue
+
+          artifacts = {os.path.basename(output['path']): output for output in entry['outputs']}
+          with open(os.path.join(output_folder, folder_name, method, 'index.html'), 'r') as f:
+            page = calc_results.parse_page(f.read())
+
+          for viewport_width, viewport_height in viewports:
+            stages = request_stages(page, viewport_width, viewport_height, density, artifacts)
+            samples.append(replay_page(executor, local, port, f"/{folder_name}/{method}", stages, keep_alive))
+
+      results[method] = (samples, time.perf_counter() - method_start)
+  finally:
+    server.shutdown()
+    server.server_close()
+
+  return results
+
+def report(results):
+  print("\nTime to last byte per page view (ms) and throughput:")
+  for method, (samples, elapsed) in results.items():
+    failed = [errors for duration, transferred, requests, errors in samples if errors]
+    if failed:
+      print(f"{method}: {len(failed)} of {len(samples)} views had failed requests and are left out, e.g. {failed[0][0]}")
+
+    transferred = sum(s[1] for s in samples)
+    requests = sum(s[2] for s in samples)
+    samples = [sample for sample in samples if not sample[3]]
+    if not samples:
+      continue
+    ttlb = [duration * 1000 for duration, transferred_bytes, request_count, errors in samples]
+    print(f"{method}: p50 {calc_results.percentile(ttlb, 50):.0f}, p90 {calc_results.percentile(ttlb, 90):.0f}, "
+          f"p99 {calc_results.percentile(ttlb, 99):.0f}, max {max(ttlb):.0f} ms; "
+          f"{transferred / elapsed / 1024:.0f} KB/s, {requests / elapsed:.0f} req/s over {len(samples)} views")
+
+def main():
+  output_folder = 'implementation/processed'
+  sample_folders = 5
+  density = 1
+  concurrency = 6
+  keep_alive = True
+  rtt = 0.05
+  bandwidth = 10 * 1000 ** 2 / 8
+
+  manifest_path = os.path.join(output_folder, 'manifest.jsonl')
+  if not os.path.exists(manifest_path):
+    print("No build manifest found. Run process-images.py first.")
+    return
+
+  folders = sorted(calc_results.read_manifest(manifest_path))[:sample_folders]
+  viewports = calc_results.calc_waste.get_common_viewport_sizes()
+
+  print(f"Replaying {len(folders)} folders x {len(viewports)} viewports, concurrency {concurrency}, "
+        f"keep-alive {keep_alive}, RTT {rtt * 1000:.0f} ms, bandwidth {bandwidth * 8 / 1000 ** 2:.1f} Mbit/s")
+  report(replay_methods(output_folder, folders, viewports, density, concurrency, keep_alive, rtt, bandwidth))
+
+if __name__ == "__main__":
+  main()
@@ -1,5 +1,15 @@
 import os
+import json
+import math
 import shutil
+from collections import Counter
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+FICLONE = 0x40049409
 
 def get_folder_size(folder):
   total_size = 0
@@ -10,26 +20,128 @@ def get_folder_size(folder):
         total_size += os.path.getsize(fp)
   return total_size
 
+def read_manifest_sizes(manifest_path, method=None):
+  folder_sizes = {}
+  with open(manifest_path, 'r') as f:
+    for line in f:
+      try:
+        record = json.loads(line)
+      except json.JSONDecodeError:
+        continue
+      entries = [record['methods'].get(method, {'outputs': []})] if method else record['methods'].values()
+      folder_sizes[record['folder']] = sum(output['bytes'] for entry in entries for output in entry['outputs'])
+  return folder_sizes
+
+def get_folder_sizes(base_path, method=None):
+  manifest_path = os.path.join(base_path, 'manifest.jsonl')
+  if os.path.exists(manifest_path):
+    return read_manifest_sizes(manifest_path, method)
+  return {
+    f: get_folder_size(os.path.join(base_path, f, method or ''))
+    for f in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, f)) and not f.startswith('.')
+  }
+
 def get_average_size_folder(base_path):
-  folder_sizes = {f: get_folder_size(os.path.join(base_path, f)) for f in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, f))}
+  folder_sizes = get_folder_sizes(base_path)
   if not folder_sizes:
     return None
   avg_size = sum(folder_sizes.values()) / len(folder_sizes)
   closest_folder = min(folder_sizes, key=lambda k: abs(folder_sizes[k] - avg_size))
   return closest_folder, folder_sizes[closest_folder]
 
-def copy_folder_to_performance(src_folder, dest_folder):
-  shutil.rmtree(dest_folder, ignore_errors=True)
-  shutil.copytree(src_folder, dest_folder)
+def select_folders(folder_sizes, percentiles):
+  if not folder_sizes:
+    return {}
+
+  ranked = sorted(folder_sizes, key=lambda k: (folder_sizes[k], k))
+  avg_size = sum(folder_sizes.values()) / len(folder_sizes)
+  selected = {'mean': min(ranked, key=lambda k: abs(folder_sizes[k] - avg_size))}
+  for p in percentiles:
+    selected[f"p{p}"] = ranked[max(0, math.ceil(p / 100 * len(ranked)) - 1)]
+  return {label: (folder, folder_sizes[folder]) for label, folder in selected.items()}
+
+def reflink(src_file, dest_file):
+  with open(src_file, 'rb') as src, open(dest_file, 'wb') as dest:
+    try:
+      if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+      fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+    except OSError:
+      dest.close()
+      os.remove(dest_file)
+      raise
+  shutil.copystat(src_file, dest_file)
+
+def publish_file(src_file, dest_file, mode):
+  src_file = os.path.realpath(src_file)
+  if mode == 'hardlink':
+    try:
+      os.link(src_file, dest_file)
+      return 'linked'
+    except OSError:
+      pass
+  if mode in ('hardlink', 'reflink'):
+    try:
+      reflink(src_file, dest_file)
+      return 'cloned'
+    except OSError:
+      pass
+  shutil.copy2(src_file, dest_file)
+  return 'copied'
+
+def unchanged(src_file, dest_file):
+  if not os.path.lexists(dest_file) or os.path.islink(dest_file):
+    return False
+  src_stat = os.stat(src_file)
+  dest_stat = os.stat(dest_file)
+  return src_stat.st_size == dest_stat.st_size and src_stat.st_mtime_ns == dest_stat.st_mtime_ns
+
+def copy_folder_to_performance(src_folder, dest_folder, mode='hardlink'):
+  stats = Counter()
+  published = set()
+
+  for dirpath, dirnames, filenames in os.walk(src_folder):
+    dest_dir = os.path.join(dest_folder, os.path.relpath(dirpath, src_folder))
+    os.makedirs(dest_dir, exist_ok=True)
+
+    for f in filenames:
+      src_file = os.path.join(dirpath, f)
+      dest_file = os.path.join(dest_dir, f)
+      published.add(os.path.normpath(dest_file))
+
+      if unchanged(src_file, dest_file):
+        stats['skipped'] += 1
+        continue
+      if os.path.lexists(dest_file):
+        os.remove(dest_file)
+      stats[publish_file(src_file, dest_file, mode)] += 1
+
+  for dirpath, dirnames, filenames in os.walk(dest_folder, topdown=False):
+    for f in filenames:
+      dest_file = os.path.join(dirpath, f)
+      if os.path.normpath(dest_file) not in published:
+        os.remove(dest_file)
+        stats['removed'] += 1
+    if not os.listdir(dirpath):
+      os.rmdir(dirpath)
+
+  return stats
 
 def main():
   base_path = 'implementation/processed'
   performance_path = 'docs'
-  
-  result = get_average_size_folder(base_path)
-  if result:
-    average_folder, size = result
-    copy_folder_to_performance(os.path.join(base_path, average_folder), os.path.join(performance_path, average_folder))
+  percentiles = [10, 50, 90]
+  method = None
+  publish_mode = 'hardlink'
+
+  folders = {}
+  for label, (folder, size) in select_folders(get_folder_sizes(base_path, method), percentiles).items():
+    folders.setdefault(folder, ([], size))[0].append(label)
+
+  for folder, (labels, size) in sorted(folders.items()):
+    stats = copy_folder_to_performance(os.path.join(base_path, folder), os.path.join(performance_path, folder), publish_mode)
+    print(f"{folder} ({', '.join(labels)}, {size / 1024:.1f} KB): {stats['linked']} linked, {stats['cloned']} cloned, "
+          f"{stats['copied']} copied, {stats['skipped']} unchanged, {stats['removed']} removed")
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
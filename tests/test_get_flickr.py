@@ -0,0 +1,373 @@
+import io
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+import contextlib
+import importlib.util
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+def load_script(path, name):
+  spec = importlib.util.spec_from_file_location(name, path)
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  spec.loader.exec_module(module)
+  return module
+
+get_flickr = load_script(os.path.join(repo_root, 'dataset/get-flickr.py'), 'get_flickr')
+
+def png_bytes(seed, width=96, height=64):
+  # Noise does not compress, so the file spans many chunks.
+  img = Image.frombytes('RGB', (width, height), random.Random(seed).randbytes(width * height * 3))
+  buffer = io.BytesIO()
+  img.save(buffer, format='PNG')
+  return buffer.getvalue()
+
+class RangeHandler(BaseHTTPRequestHandler):
+  # Serves server.content with ETag and single-range support. The server's switches make it drop
+  # the connection part way, ignore Range headers, or answer 416 for ranges past the end.
+  def do_GET(self):
+    server = self.server
+    server.requests.append({'range': self.headers.get('Range'), 'if_range': self.headers.get('If-Range')})
+    body = server.content
+    requested = self.headers.get('Range')
+    if_range = self.headers.get('If-Range')
+
+    if requested and not server.ignore_range and if_range in (None, server.etag):
+      start = int(requested.split('=')[1].split('-')[0])
+      if start >= len(body):
+        self.send_response(416)
+        self.send_header('Content-Range', f"bytes */{len(body)}")
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return
+      self.send_response(206)
+      self.send_header('Content-Range', f"bytes {start}-{len(body) - 1}/{len(body)}")
+      body = body[start:]
+    else:
+      self.send_response(200)
+
+    self.send_header('ETag', server.etag)
+    self.send_header('Content-Type', 'image/png')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+
+    if server.drop_after is not None:
+      self.wfile.write(body[:server.drop_after])
+      self.wfile.flush()
+      self.close_connection = True
+      server.drop_after = None
+      return
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class DownloadTest(unittest.TestCase):
+  def setUp(self):
+    self.folder = tempfile.mkdtemp(prefix='get-flickr-test-')
+    self.ledger_path = os.path.join(self.folder, get_flickr.ledger_filename)
+    self.content = png_bytes(1)
+
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    self.server.content = self.content
+    self.server.etag = '"v1"'
+    self.server.drop_after = None
+    self.server.ignore_range = False
+    self.server.requests = []
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    self.url = f"http://127.0.0.1:{self.server.server_address[1]}/image.png"
+
+    self.saved = get_flickr.chunk_size, get_flickr.backoff_base
+    get_flickr.chunk_size = 1024
+    get_flickr.backoff_base = 0
+
+  def tearDown(self):
+    get_flickr.chunk_size, get_flickr.backoff_base = self.saved
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.folder, ignore_errors=True)
+
+  def download(self, ledger=None):
+    ledger = get_flickr.load_ledger(self.ledger_path) if ledger is None else ledger
+    with contextlib.redirect_stdout(io.StringIO()):
+      result = get_flickr.download_and_save_image(self.url, 'image', self.folder, ledger_path=self.ledger_path, ledger=ledger)
+    return result, ledger
+
+  def saved_bytes(self):
+    with open(os.path.join(self.folder, 'image.png'), 'rb') as f:
+      return f.read()
+
+  def write_partial(self, data, record):
+    with open(os.path.join(self.folder, 'image.part'), 'wb') as f:
+      f.write(data)
+    record = dict({'url': self.url, 'path': os.path.join(self.folder, 'image.part'), 'received': len(data), 'complete': False}, **record)
+    with open(self.ledger_path, 'w') as f:
+      f.write(json.dumps(record) + '\n')
+
+  def test_resumes_after_dropped_connection(self):
+    self.server.drop_after = len(self.content) // 2
+    result, ledger = self.download()
+
+    self.assertIsNotNone(result)
+    self.assertEqual(self.saved_bytes(), self.content)
+    first, second = self.server.requests
+    self.assertIsNone(first['range'])
+    self.assertEqual(second['if_range'], '"v1"')
+    offset = int(second['range'].split('=')[1].split('-')[0])
+    self.assertGreater(offset, 0)
+    self.assertLessEqual(offset, len(self.content) // 2)
+    self.assertTrue(ledger[self.url]['complete'])
+    self.assertFalse(os.path.exists(os.path.join(self.folder, 'image.part')))
+
+  def test_restarts_when_server_sends_whole_file(self):
+    self.write_partial(b'x' * 500, {'expected_length': len(self.content), 'validator': '"v1"'})
+    self.server.ignore_range = True
+    result, ledger = self.download()
+
+    self.assertIsNotNone(result)
+    self.assertEqual(self.server.requests[0]['range'], 'bytes=500-')
+    self.assertEqual(self.saved_bytes(), self.content)
+    self.assertEqual(ledger[self.url]['sha256'], get_flickr.file_sha256(os.path.join(self.folder, 'image.png')).hexdigest())
+
+  def test_restarts_when_validator_changed(self):
+    self.write_partial(png_bytes(2)[:500], {'expected_length': len(self.content), 'validator': '"v0"'})
+    result, _ = self.download()
+
+    self.assertIsNotNone(result)
+    self.assertEqual(self.server.requests[0]['if_range'], '"v0"')
+    self.assertEqual(self.saved_bytes(), self.content)
+
+  def test_416_completes_finished_partial(self):
+    self.write_partial(self.content, {'expected_length': len(self.content), 'validator': '"v1"'})
+    result, ledger = self.download()
+
+    self.assertIsNotNone(result)
+    self.assertEqual(len(self.server.requests), 1)
+    self.assertEqual(self.saved_bytes(), self.content)
+    self.assertTrue(ledger[self.url]['complete'])
+
+  def test_416_discards_unresumable_partial(self):
+    self.write_partial(self.content + b'junk', {'expected_length': len(self.content) + 100, 'validator': '"v1"'})
+    result, _ = self.download()
+
+    self.assertIsNotNone(result)
+    self.assertEqual([request['range'] for request in self.server.requests], [f"bytes={len(self.content) + 4}-", None])
+    self.assertEqual(self.saved_bytes(), self.content)
+
+  def test_refetches_truncated_file(self):
+    self.download()
+    with open(os.path.join(self.folder, 'image.png'), 'r+b') as f:
+      f.truncate(len(self.content) // 3)
+
+    result, _ = self.download()
+    self.assertIsNotNone(result)
+    self.assertEqual(len(self.server.requests), 2)
+    self.assertEqual(self.saved_bytes(), self.content)
+
+  def test_refetches_modified_file(self):
+    self.download()
+    with open(os.path.join(self.folder, 'image.png'), 'r+b') as f:
+      f.seek(len(self.content) // 2)
+      f.write(b'\0' * 16)
+
+    result, _ = self.download()
+    self.assertIsNotNone(result)
+    self.assertEqual(len(self.server.requests), 2)
+    self.assertEqual(self.saved_bytes(), self.content)
+
+  def test_keeps_verified_file(self):
+    self.download()
+    result, _ = self.download()
+
+    self.assertIsNotNone(result)
+    self.assertEqual(len(self.server.requests), 1)
+
+class ImageHandler(BaseHTTPRequestHandler):
+  # /ok-N.png serves image N after an optional ?delay, /busy-N.png answers 429 with Retry-After
+  # on its first request, and /missing.png is always 404.
+  def do_GET(self):
+    url = urlparse(self.path)
+    name = url.path.strip('/')
+    with self.server.lock:
+      self.server.requests.append(name)
+      first = self.server.requests.count(name) == 1
+    time.sleep(float(parse_qs(url.query).get('delay', ['0'])[0]))
+
+    if name == 'missing.png' or (name.startswith('busy-') and first):
+      self.send_response(404 if name == 'missing.png' else 429)
+      self.send_header('Retry-After', '0')
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+
+    body = png_bytes(int(name.split('-')[1].split('.')[0]))
+    self.send_response(200)
+    self.send_header('Content-Type', 'image/png')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class CsvDownloadTest(unittest.TestCase):
+  def setUp(self):
+    self.folder = tempfile.mkdtemp(prefix='get-flickr-test-')
+    self.csv_filename = os.path.join(self.folder, 'dataset.csv')
+    self.save_dir = os.path.join(self.folder, 'target')
+
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+    self.server.requests = []
+    self.server.lock = threading.Lock()
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    self.saved = get_flickr.backoff_base
+    get_flickr.backoff_base = 0
+
+  def tearDown(self):
+    get_flickr.backoff_base = self.saved
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.folder, ignore_errors=True)
+
+  def download(self, rows, workers=4):
+    with open(self.csv_filename, 'w', newline='', encoding='utf-8') as f:
+      writer = csv.writer(f)
+      writer.writerow(['Image URL', 'Title', 'Width', 'Height', 'File Size (KB)'])
+      writer.writerows([f"{self.base_url}/{path}", title, 96, 64, ''] for path, title in rows)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+      failed = get_flickr.download_images_from_csv(self.csv_filename, workers=workers, limiter=get_flickr.RateLimiter(1000), save_dir=self.save_dir)
+
+    with open(self.csv_filename, 'r', encoding='utf-8') as f:
+      return failed, list(csv.reader(f))[1:]
+
+  def test_retries_after_429(self):
+    failed, rows = self.download([('busy-1.png', 'busy')])
+
+    self.assertEqual(failed, [])
+    self.assertEqual(self.server.requests, ['busy-1.png', 'busy-1.png'])
+    self.assertEqual([row[1] for row in rows], ['busy'])
+    self.assertTrue(os.path.exists(os.path.join(self.save_dir, 'busy.png')))
+
+  def test_fails_fast_on_404(self):
+    failed, rows = self.download([('missing.png', 'missing'), ('ok-1.png', 'ok')])
+
+    self.assertEqual(failed, [(f"{self.base_url}/missing.png", 'missing')])
+    self.assertEqual(self.server.requests.count('missing.png'), 1)
+    self.assertEqual([row[1] for row in rows], ['ok'])
+
+  def test_keeps_csv_order(self):
+    # Earlier rows take longer, so downloads finish in reverse order.
+    titles = [f"image {i}" for i in range(6)]
+    failed, rows = self.download([(f"ok-{i}.png?delay={0.3 - i * 0.05:.2f}", title) for i, title in enumerate(titles)])
+
+    self.assertEqual(failed, [])
+    self.assertEqual([row[1] for row in rows], titles)
+    self.assertTrue(all(float(row[4]) > 0 for row in rows))
+
+class SearchHandler(BaseHTTPRequestHandler):
+  # A stand-in for flickr.photos.search with server.pages pages of two photos each: one landscape
+  # original and one portrait that the search filters out.
+  def do_GET(self):
+    params = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+    page = int(params['page'])
+    with self.server.lock:
+      self.server.requests.append(params)
+
+    photos = [
+      {'url_o': f"http://example.com/{page}-wide.jpg", 'title': f"{page} wide", 'width_o': '2000', 'height_o': '1000'},
+      {'url_o': f"http://example.com/{page}-tall.jpg", 'title': f"{page} tall", 'width_o': '1000', 'height_o': '2000'}
+    ] if page <= self.server.pages else []
+    body = json.dumps({'photos': {'page': page, 'pages': self.server.pages, 'photo': photos}, 'stat': 'ok'}).encode()
+
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class SearchTest(unittest.TestCase):
+  def setUp(self):
+    self.folder = tempfile.mkdtemp(prefix='get-flickr-test-')
+
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), SearchHandler)
+    self.server.pages = 5
+    self.server.requests = []
+    self.server.lock = threading.Lock()
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    self.endpoint = f"http://127.0.0.1:{self.server.server_address[1]}/rest/"
+
+    self.saved = get_flickr.search_cache_folder, get_flickr.api_requests_per_second
+    get_flickr.search_cache_folder = os.path.join(self.folder, 'cache')
+    get_flickr.api_requests_per_second = 1000
+
+  def tearDown(self):
+    get_flickr.search_cache_folder, get_flickr.api_requests_per_second = self.saved
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.folder, ignore_errors=True)
+
+  def search(self, api_key='key', num_photos=100):
+    with contextlib.redirect_stdout(io.StringIO()):
+      return sorted(get_flickr.search_photos(api_key, 'institution', num_photos, endpoint=self.endpoint, workers=2))
+
+  def requested_pages(self):
+    return [int(params['page']) for params in self.server.requests]
+
+  def test_reads_page_count_from_first_page(self):
+    photos = self.search()
+
+    pages = self.requested_pages()
+    self.assertEqual(pages[0], 1)
+    self.assertEqual(sorted(pages), [1, 2, 3, 4, 5])
+    self.assertEqual(photos, sorted((f"http://example.com/{page}-wide.jpg", f"{page} wide", 2000, 1000) for page in range(1, 6)))
+
+  def test_stops_once_enough_photos(self):
+    self.assertEqual(len(self.search(num_photos=2)), 2)
+    self.assertEqual(sorted(self.requested_pages()), [1, 2, 3])
+
+  def test_cache_hit_makes_no_request(self):
+    first = self.search()
+    self.server.requests.clear()
+
+    self.assertEqual(self.search(), first)
+    self.assertEqual(self.server.requests, [])
+
+  def test_expired_cache_refetches(self):
+    self.search()
+    self.server.requests.clear()
+    expired = time.time() - get_flickr.search_cache_ttl - 60
+    for name in os.listdir(get_flickr.search_cache_folder):
+      os.utime(os.path.join(get_flickr.search_cache_folder, name), (expired, expired))
+
+    self.search()
+    self.assertEqual(sorted(self.requested_pages()), [1, 2, 3, 4, 5])
+
+  def test_cache_key_ignores_api_key(self):
+    self.search(api_key='first')
+    self.server.requests.clear()
+
+    self.search(api_key='second')
+    self.assertEqual(self.server.requests, [])
+    for name in os.listdir(get_flickr.search_cache_folder):
+      with open(os.path.join(get_flickr.search_cache_folder, name), 'r') as f:
+        self.assertNotIn('first', f.read())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,19 @@
+import os
+import sys
+import csv
+import json
 import math
-from typing import List, Tuple
+import hashlib
+import importlib.util
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+def load_script(path: str, name: str):
+  spec = importlib.util.spec_from_file_location(name, path)
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  spec.loader.exec_module(module)
+  return module
 
 def get_priority_viewport_sizes() -> List[Tuple[int, int]]:
   return [
@@ -13,6 +27,27 @@ def get_secondary_viewport_sizes() -> List[Tuple[int, int]]:
     (430, 932), (360, 760), (375, 667), (393, 851)
   ]
 
+def get_viewport_density_distribution() -> List[Tuple[int, int, float, float]]:
+  return [
+    (1920, 1080, 1.0, 1.0), (1366, 768, 1.0, 1.0), (1536, 864, 1.25, 1.0), (1280, 720, 1.5, 1.0),
+    (1440, 900, 2.0, 1.0), (768, 1024, 2.0, 1.0), (412, 915, 2.625, 1.0), (360, 800, 3.0, 1.0),
+    (390, 844, 3.0, 1.0), (393, 873, 2.75, 1.0), (414, 896, 2.0, 1.0), (360, 780, 3.0, 1.0),
+    (375, 812, 3.0, 1.0), (385, 854, 2.0, 1.0), (428, 926, 3.0, 1.0), (360, 640, 2.0, 1.0),
+    (393, 852, 3.0, 1.0), (430, 932, 3.0, 1.0), (360, 760, 3.0, 1.0), (375, 667, 2.0, 1.0),
+    (393, 851, 2.75, 1.0)
+  ]
+
+def read_viewport_distribution(csv_path: str) -> List[Tuple[int, int, float, float]]:
+  distribution = []
+
+  with open(csv_path, 'r', newline='') as f:
+    for row in csv.reader(f):
+      if not row or not row[0].strip().isdigit():
+        continue
+      weight = float(row[3]) if len(row) > 3 and row[3].strip() else 1.0
+      distribution.append((int(row[0]), int(row[1]), float(row[2]), weight))
+  return distribution
+
 def get_divisors(n: int) -> List[int]:
   divisors = set()
   for i in range(1, int(math.sqrt(n)) + 1):
@@ -33,36 +68,64 @@ def calculate_pixel_waste(viewport_width: int, viewport_height: int, tile_width:
 
   return (waste_x * viewport_height) + (waste_y * viewport_width) - (waste_x * waste_y)
 
-def optimal_tile_size(image_width: int, image_height: int, primary_breakpoints: List[Tuple[int, int]], secondary_breakpoints: List[Tuple[int, int]]) -> Tuple[Tuple[int, int], float]:
-  min_tile_size = 120
+def axis_overshoot(tile_sizes: np.ndarray, viewport_sizes: np.ndarray) -> np.ndarray:
+  tiles = tile_sizes[:, None]
+  return -(-viewport_sizes[None, :] // tiles) * tiles - viewport_sizes[None, :]
+
+def score_tile_grid(tile_widths: np.ndarray, tile_heights: np.ndarray, viewports: np.ndarray, weights: np.ndarray, chunk_size: int = 4096) -> np.ndarray:
+  expected_waste = np.zeros((len(tile_widths), len(tile_heights)))
 
-  all_tile_sizes = set()
+  for start in range(0, len(viewports), chunk_size):
+    viewport_widths = viewports[start:start + chunk_size, 0]
+    viewport_heights = viewports[start:start + chunk_size, 1]
+    chunk_weights = weights[start:start + chunk_size]
 
-  for width, height in primary_breakpoints + secondary_breakpoints:
-    divisors_width = get_divisors(width)
-    divisors_height = get_divisors(height)
+    waste_x = axis_overshoot(tile_widths, viewport_widths).astype(np.float64)
+    waste_y = axis_overshoot(tile_heights, viewport_heights).astype(np.float64)
+
+    expected_waste += (waste_x @ (chunk_weights * viewport_heights))[:, None]
+    expected_waste += (waste_y @ (chunk_weights * viewport_widths))[None, :]
+    expected_waste -= (waste_x * chunk_weights) @ waste_y.T
+
+  return expected_waste / weights.sum()
+
+def divisor_candidates(viewports: np.ndarray, min_tile_size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  pairs = []
+  for width, height in {(int(w), int(h)) for w, h in viewports}:
+    pairs.append((
+      [d for d in get_divisors(width) if d >= min_tile_size],
+      [d for d in get_divisors(height) if d >= min_tile_size]
+    ))
+
+  tile_widths = np.array(sorted({d for widths, heights in pairs for d in widths}), dtype=np.int64)
+  tile_heights = np.array(sorted({d for widths, heights in pairs for d in heights}), dtype=np.int64)
+
+  allowed = np.zeros((len(tile_widths), len(tile_heights)), dtype=bool)
+  for widths, heights in pairs:
+    allowed[np.ix_(np.searchsorted(tile_widths, widths), np.searchsorted(tile_heights, heights))] = True
+
+  return tile_widths, tile_heights, allowed
+
+def optimal_tile_size(image_width: int, image_height: int, primary_breakpoints: List[Tuple[int, int]], secondary_breakpoints: List[Tuple[int, int]], weights: Optional[List[float]] = None, search: str = 'divisors') -> Tuple[Tuple[int, int], float]:
+  min_tile_size = 120
 
-    for dw in divisors_width:
-      if dw >= min_tile_size:
-        for dh in divisors_height:
-          if dh >= min_tile_size:
-            all_tile_sizes.add((dw, dh))
+  viewports = np.array(primary_breakpoints + secondary_breakpoints, dtype=np.int64)
+  weights = np.ones(len(viewports)) if weights is None else np.asarray(weights, dtype=np.float64)
 
-  best_tile_size = None
-  min_average_pixel_waste = float('inf')
+  if search == 'divisors':
+    tile_widths, tile_heights, allowed = divisor_candidates(viewports, min_tile_size)
+  else:
+    tile_widths = np.arange(min_tile_size, max(min_tile_size, viewports[:, 0].max()) + 1, dtype=np.int64)
+    tile_heights = np.arange(min_tile_size, max(min_tile_size, viewports[:, 1].max()) + 1, dtype=np.int64)
+    allowed = np.ones((len(tile_widths), len(tile_heights)), dtype=bool)
 
-  for tw, th in all_tile_sizes:
-    total_pixel_waste = sum(
-      calculate_pixel_waste(width, height, tw, th) 
-      for width, height in primary_breakpoints + secondary_breakpoints
-    )
-    average_pixel_waste = total_pixel_waste / (len(primary_breakpoints) + len(secondary_breakpoints))
+  if not allowed.any():
+    return None, float('inf')
 
-    if average_pixel_waste < min_average_pixel_waste:
-      min_average_pixel_waste = average_pixel_waste
-      best_tile_size = (tw, th)
+  expected_waste = np.where(allowed, score_tile_grid(tile_widths, tile_heights, viewports, weights), np.inf)
+  best_w, best_h = np.unravel_index(np.argmin(expected_waste), expected_waste.shape)
 
-  return best_tile_size, min_average_pixel_waste
+  return (int(tile_widths[best_w]), int(tile_heights[best_h])), float(expected_waste[best_w, best_h])
 
 def calculate_final_pixel_waste(image_width: int, image_height: int, final_tile_width: int, final_tile_height: int, primary_breakpoints: List[Tuple[int, int]], secondary_breakpoints: List[Tuple[int, int]]) -> float:
   total_pixel_waste = sum(
@@ -73,60 +136,208 @@ def calculate_final_pixel_waste(image_width: int, image_height: int, final_tile_
   
   return (total_pixel_waste / total_viewport_area) * 100
 
+# The build ships one 2x master for every density, so the tiles a view receives, and the master
+# pixels in them, depend only on its CSS size. Views are therefore weighted by count alone.
+def aggregate_view_weights(distribution: List[Tuple[int, int, float, float]]) -> Tuple[List[Tuple[int, int]], List[float]]:
+  weights = {}
+  for width, height, density, weight in distribution:
+    weights[(width, height)] = weights.get((width, height), 0.0) + weight
+  return list(weights), list(weights.values())
+
+def optimal_tile_size_for_densities(image_width: int, image_height: int, distribution: List[Tuple[int, int, float, float]], search: str = 'divisors') -> Tuple[Tuple[int, int], float]:
+  viewports, weights = aggregate_view_weights(distribution)
+  return optimal_tile_size(image_width, image_height, viewports, [], weights=weights, search=search)
+
+def density_waste_table(distribution: List[Tuple[int, int, float, float]], tile_width: int, tile_height: int, master_density: float = 2.0) -> Dict[float, Tuple[float, float, float, float]]:
+  css_waste = {}
+  totals = {}
+
+  for width, height, density, weight in distribution:
+    if (width, height) not in css_waste:
+      css_waste[(width, height)] = calculate_pixel_waste(width, height, tile_width, tile_height)
+
+    scale = weight * master_density ** 2
+    share, waste, area = totals.get(density, (0.0, 0.0, 0.0))
+    totals[density] = (share + weight, waste + css_waste[(width, height)] * scale, area + width * height * scale)
+
+  return {
+    density: (share, waste / area * 100, waste / share, (waste + area) / share)
+    for density, (share, waste, area) in sorted(totals.items())
+  }
+
+def pruner_visible_tiles(viewport_width: int, viewport_height: int, columns: int, rows: int, tile_width: int, tile_height: int) -> List[int]:
+  scale = 0.5 if tile_width * columns > 1920 or tile_height * rows > 1080 else 1
+  display_width = math.floor(tile_width * scale + 0.5)
+  display_height = math.floor(tile_height * scale + 0.5)
+
+  visible_columns = min(math.ceil(viewport_width / display_width), columns)
+  visible_rows = min(math.ceil(viewport_height / display_height), rows)
+
+  first_row = max(0, min(rows // 2 - visible_rows // 2, rows - visible_rows))
+  first_column = max(0, min(columns // 2 - visible_columns // 2, columns - visible_columns))
+
+  return [
+    row * columns + column + 1
+    for row in range(first_row, first_row + visible_rows)
+    for column in range(first_column, first_column + visible_columns)
+  ]
+
+def candidate_grids(image_width: int, image_height: int, viewports: List[Tuple[int, int]], weights: List[float], count: int = 8) -> List[Tuple[int, int]]:
+  viewport_array = np.array(viewports, dtype=np.int64)
+  tile_widths, tile_heights, allowed = divisor_candidates(viewport_array, 120)
+  scores = np.where(allowed, score_tile_grid(tile_widths, tile_heights, viewport_array, np.asarray(weights, dtype=np.float64)), np.inf)
+
+  grids = []
+  for index in np.argsort(scores, axis=None):
+    if not np.isfinite(scores.flat[index]) or len(grids) == count:
+      break
+    w, h = np.unravel_index(index, scores.shape)
+    grid = (math.ceil(image_width / tile_widths[w]), math.ceil(image_height / tile_heights[h]))
+    if grid not in grids:
+      grids.append(grid)
+  return grids
+
+def calibrate_tile_bytes(sample_paths: List[str], grids: List[Tuple[int, int]], cache_path: str = 'waste/calibration.json') -> Dict[Tuple[int, int], List[List[int]]]:
+  process_images = load_script('implementation/process-images.py', 'process_images')
+  target_width, target_height = process_images.image_sizes['pruner'][0]
+
+  cache = {}
+  if os.path.exists(cache_path):
+    with open(cache_path, 'r') as f:
+      cache = json.load(f)
+
+  settings = hashlib.sha256(json.dumps([
+    process_images.build_version, process_images.webp_quality, process_images.webp_method,
+    process_images.encode_target, process_images.fast_resample, process_images.reducing_gap
+  ]).encode()).hexdigest()[:16]
+
+  tile_bytes = {grid: [] for grid in grids}
+
+  for path in sample_paths:
+    source_hash = process_images.file_hash(path)
+    master = None
+
+    for columns, rows in grids:
+      key = f"{source_hash}:{settings}:{columns}x{rows}"
+      if key not in cache:
+        if master is None:
+          with process_images.open_source(path, [(target_width, target_height)]) as img:
+            master = process_images.resize_and_crop(img, target_width, target_height)
+
+        cell_width = master.width // columns
+        cell_height = master.height // rows
+        cache[key] = [
+          len(process_images.encode_webp(master.crop((col * cell_width, row * cell_height, (col + 1) * cell_width, (row + 1) * cell_height))))
+          for row in range(rows) for col in range(columns)
+        ]
+      tile_bytes[(columns, rows)].append(cache[key])
+
+  with open(cache_path, 'w') as f:
+    json.dump(cache, f)
+
+  return tile_bytes
+
+def grid_costs(tile_bytes: Dict[Tuple[int, int], List[List[int]]], viewports: List[Tuple[int, int]], weights: List[float], master_width: int, master_height: int, request_cost: float) -> Dict[Tuple[int, int], Tuple[float, float, float]]:
+  total_weight = sum(weights)
+  costs = {}
+
+  for (columns, rows), samples in tile_bytes.items():
+    tile_width = master_width // columns
+    tile_height = master_height // rows
+    expected_bytes, expected_requests = 0.0, 0.0
+
+    for (width, height), weight in zip(viewports, weights):
+      tiles = sorted(set([1] + pruner_visible_tiles(width, height, columns, rows, tile_width, tile_height)))
+      expected_bytes += weight * sum(sum(sample[tile - 1] for tile in tiles) for sample in samples) / len(samples)
+      expected_requests += weight * len(tiles)
+
+    expected_bytes /= total_weight
+    expected_requests /= total_weight
+    costs[(columns, rows)] = (expected_bytes, expected_requests, expected_bytes + request_cost * expected_requests)
+
+  return costs
+
+def choose_grid_by_cost(image_width: int, image_height: int, distribution: List[Tuple[int, int, float, float]], sample_paths: List[str], request_cost: float, extra_grids: List[Tuple[int, int]]) -> Tuple[Tuple[int, int], Dict[Tuple[int, int], Tuple[float, float, float]]]:
+  viewports, weights = aggregate_view_weights(distribution)
+  grids = candidate_grids(image_width, image_height, viewports, weights)
+  grids += [grid for grid in extra_grids if grid not in grids]
+
+  tile_bytes = calibrate_tile_bytes(sample_paths, grids)
+  costs = grid_costs(tile_bytes, viewports, weights, image_width * 2, image_height * 2, request_cost)
+  return min(costs, key=lambda grid: costs[grid][2]), costs
+
+def save_pruner_grid(grid: Tuple[int, int], grid_path: str = 'implementation/assets/pruner-grid.json') -> None:
+  with open(grid_path, 'w') as f:
+    json.dump({'columns': grid[0], 'rows': grid[1]}, f, indent=2)
+
 def main() -> None:
+  # Paths here and in process-images.py, which calibration loads, are relative to the repository
+  # root, so run from there whatever the working directory.
+  os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+  write_grid = '--write-grid' in sys.argv[1:]
+
   image_width = 1920
   image_height = 1080
 
-  density = 1.0  # Hardcoded density to 1x
+  distribution_path = 'waste/viewport-distribution.csv'
 
-  primary_breakpoints = get_priority_viewport_sizes()
-  secondary_breakpoints = get_secondary_viewport_sizes()
+  if os.path.exists(distribution_path):
+    distribution = read_viewport_distribution(distribution_path)
+    print(f"Using {len(distribution)} views from {distribution_path}")
+  else:
+    distribution = get_viewport_density_distribution()
+    print(f"{distribution_path} not found, using the built-in equal-weight distribution")
 
-  best_tile_size, average_pixel_waste = optimal_tile_size(
-    image_width, 
-    image_height, 
-    primary_breakpoints, 
-    secondary_breakpoints
-  )
+  best_tile_size, _ = optimal_tile_size_for_densities(image_width, image_height, distribution)
 
   if best_tile_size:
     tw, th = best_tile_size
 
-    tw_scaled = tw * density
-    th_scaled = th * density
-
-    tw_scaled = max(tw_scaled, 120)
-    th_scaled = max(th_scaled, 120)
-
     columns = math.ceil(image_width / tw)
     rows = math.ceil(image_height / th)
     total_tiles = columns * rows
 
-    image_width_scaled = image_width * density
-    image_height_scaled = image_height * density
-
-    tile_width_scaled = image_width_scaled / columns
-    tile_height_scaled = image_height_scaled / rows
-
-    density_str = f"{int(density)}x" if density == int(density) else f"{density}x"
-
-    average_pixel_waste_percentage = calculate_final_pixel_waste(
-      image_width, 
-      image_height, 
-      tw, 
-      th, 
-      primary_breakpoints, 
-      secondary_breakpoints
-    )
+    table = density_waste_table(distribution, tw, th)
+    total_share = sum(share for share, waste, waste_pixels, transferred in table.values())
+    expected_waste = sum(share * waste_pixels for share, waste, waste_pixels, transferred in table.values()) / total_share
 
     print("\nTile calculation complete!")
-    print(f"Image dimensions ({density_str}) = {image_width_scaled} x {image_height_scaled}px")
     print(f"Columns = {columns}, Rows = {rows}")
     print(f"Total tiles = {total_tiles}")
-    print(f"Tile dimensions ({density_str}) = {tile_width_scaled:.2f} x {tile_height_scaled:.2f}px")
-    print(f"Average pixel waste (pre-scaling) = {average_pixel_waste_percentage:.2f}%")
+    print(f"Master dimensions = {image_width * 2} x {image_height * 2}px, tile dimensions = {image_width * 2 / columns:.2f} x {image_height * 2 / rows:.2f}px")
+
+    for density, (share, waste, waste_pixels, transferred) in table.items():
+      density_str = f"{int(density)}x" if density == int(density) else f"{density}x"
+      print(f"\n{density_str} ({share / total_share * 100:.1f}% of views)")
+      print(f"Average pixel waste = {waste:.2f}% ({waste_pixels:,.0f} master px per view)")
+      print(f"Expected transferred master pixels per view = {transferred:,.0f}")
+
+    print(f"\nExpected pixel waste per view (all densities) = {expected_waste:,.0f} master px")
   else:
     print("No suitable tile size found.")
 
+  target_folder = 'implementation/target'
+  sample_size = 10
+  request_cost = 1000
+
+  valid_extensions = ['.jpg', '.jpeg', '.png', '.webp']
+  images = sorted(f for f in os.listdir(target_folder) if any(f.lower().endswith(ext) for ext in valid_extensions)) if os.path.isdir(target_folder) else []
+  if not images:
+    print(f"\nNo images in {target_folder}, skipping byte calibration.")
+    return
+
+  sample_paths = [os.path.join(target_folder, f) for f in images[:sample_size]]
+  best_grid, costs = choose_grid_by_cost(image_width, image_height, distribution, sample_paths, request_cost, [(14, 6)])
+
+  print(f"\nByte calibration on {len(sample_paths)} images (request cost = {request_cost} bytes):")
+  for (grid_columns, grid_rows), (expected_bytes, expected_requests, cost) in sorted(costs.items(), key=lambda item: item[1][2]):
+    print(f"{grid_columns} x {grid_rows}: {expected_bytes / 1024:.1f} KB, {expected_requests:.1f} requests, cost {cost / 1024:.1f} KB")
+
+  if write_grid:
+    save_pruner_grid(best_grid)
+    print(f"\nSelected grid = {best_grid[0]} x {best_grid[1]}, written to implementation/assets/pruner-grid.json")
+  else:
+    print(f"\nSelected grid = {best_grid[0]} x {best_grid[1]}. Run with --write-grid to write it to implementation/assets/pruner-grid.json")
+
 if __name__ == "__main__":
   main()
\ No newline at end of file
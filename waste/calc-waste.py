@@ -1,4 +1,9 @@
-from typing import List, Tuple
+import os
+import sys
+import csv
+import json
+from typing import Dict, List, Tuple
+import numpy as np
 
 def get_three_breakpoint() -> List[Tuple[int, int]]:
   return [(1920, 1080), (768, 1024), (360, 800)]
@@ -12,6 +17,126 @@ def get_common_viewport_sizes() -> List[Tuple[int, int]]:
           (375, 812), (385, 854), (428, 926), (360, 640), (393, 852), (430, 932),
           (360, 760), (375, 667), (393, 851)]
 
+def get_pruner_grid(grid_path: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'implementation', 'assets', 'pruner-grid.json'), default: Tuple[int, int] = (14, 6)) -> Tuple[int, int]:
+  if not os.path.exists(grid_path):
+    return default
+  with open(grid_path, 'r') as f:
+    grid = json.load(f)
+  return grid['columns'], grid['rows']
+
+def read_viewport_log(csv_path: str) -> Tuple[np.ndarray, np.ndarray]:
+  histogram: Dict[Tuple[int, int], int] = {}
+
+  with open(csv_path, 'r', newline='') as f:
+    for row in csv.reader(f):
+      if not row or not row[0].strip().isdigit():
+        continue
+      key = (int(row[0]), int(row[1]))
+      histogram[key] = histogram.get(key, 0) + (int(row[2]) if len(row) > 2 and row[2].strip() else 1)
+
+  viewports = np.array(list(histogram), dtype=np.int64).reshape(-1, 2)
+  weights = np.array(list(histogram.values()), dtype=np.float64)
+  return viewports, weights
+
+def weighted_waste(image_area: np.ndarray, viewport_area: np.ndarray, weights: np.ndarray, byte_per_pixel: int) -> Tuple[float, float, float]:
+  total_waste = float(weights @ (image_area - viewport_area))
+  total_area = float(weights @ image_area)
+  views = float(weights.sum())
+  if total_area == 0 or views == 0:
+    return 0.0, 0.0, 0.0
+  return total_waste / total_area * 100, total_waste / views, total_waste * byte_per_pixel / views
+
+def clamped_viewport_area(image_size: np.ndarray, viewports: np.ndarray) -> np.ndarray:
+  # A viewport larger than the image shows the whole image upscaled; none of it is wasted.
+  return np.minimum(viewports[:, 0], image_size[:, 0]) * np.minimum(viewports[:, 1], image_size[:, 1])
+
+def breakpoint_fits(primary_sizes: List[Tuple[int, int]], viewports: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  breakpoints = np.array(sorted(primary_sizes), dtype=np.int64)
+  fits = (breakpoints[None, :, 0] >= viewports[:, None, 0]) & (breakpoints[None, :, 1] >= viewports[:, None, 1])
+  return breakpoints, fits
+
+def uncovered_share(primary_sizes: List[Tuple[int, int]], viewports: np.ndarray, weights: np.ndarray) -> float:
+  _, fits = breakpoint_fits(primary_sizes, viewports)
+  views = float(weights.sum())
+  return float(weights[~fits.any(axis=1)].sum()) / views * 100 if views else 0.0
+
+def breakpoint_waste(primary_sizes: List[Tuple[int, int]], viewports: np.ndarray, weights: np.ndarray, byte_per_pixel: int = 3) -> Tuple[float, float, float]:
+  # Views that no breakpoint covers still get an image: the widest one, as a browser falls back to.
+  breakpoints, fits = breakpoint_fits(primary_sizes, viewports)
+  selected = breakpoints[np.where(fits.any(axis=1), fits.argmax(axis=1), len(breakpoints) - 1)]
+
+  image_area = selected[:, 0] * selected[:, 1]
+  return weighted_waste(image_area, clamped_viewport_area(selected, viewports), weights, byte_per_pixel)
+
+def single_image_waste(image_width: int, image_height: int, viewports: np.ndarray, weights: np.ndarray, byte_per_pixel: int = 3) -> Tuple[float, float, float]:
+  image_size = np.tile(np.array([[image_width, image_height]], dtype=np.int64), (len(viewports), 1))
+  image_area = image_size[:, 0] * image_size[:, 1]
+  return weighted_waste(image_area, clamped_viewport_area(image_size, viewports), weights, byte_per_pixel)
+
+def pruner_waste(image_width: int, image_height: int, columns: int, rows: int, viewports: np.ndarray, weights: np.ndarray, byte_per_pixel: int = 3) -> Tuple[float, float, float]:
+  tile_width = image_width / columns
+  tile_height = image_height / rows
+  visible_columns = np.minimum(np.ceil(viewports[:, 0] / tile_width), columns)
+  visible_rows = np.minimum(np.ceil(viewports[:, 1] / tile_height), rows)
+
+  image_area = visible_columns * tile_width * visible_rows * tile_height
+  viewport_area = np.minimum(viewports[:, 0], image_width) * np.minimum(viewports[:, 1], image_height)
+  return weighted_waste(image_area, viewport_area, weights, byte_per_pixel)
+
+def summarise_viewport_log(csv_path: str, image_width: int = 1920, image_height: int = 1080) -> Dict[str, Tuple[float, float, float]]:
+  viewports, weights = read_viewport_log(csv_path)
+  columns, rows = get_pruner_grid()
+
+  return {
+    '3-breakpoint': breakpoint_waste(get_three_breakpoint(), viewports, weights),
+    '5-breakpoint': breakpoint_waste(get_five_breakpoint(), viewports, weights),
+    'benchmark': single_image_waste(image_width, image_height, viewports, weights),
+    f"pruner {columns}x{rows}": pruner_waste(image_width, image_height, columns, rows, viewports, weights)
+  }
+
+def optimal_breakpoints(viewports: np.ndarray, weights: np.ndarray, count: int) -> Tuple[List[Tuple[int, int]], float]:
+  widths, groups = np.unique(viewports[:, 0], return_inverse=True)
+  group_weights = np.bincount(groups, weights=weights, minlength=len(widths))
+  group_heights = np.zeros(len(widths), dtype=np.int64)
+  np.maximum.at(group_heights, groups, viewports[:, 1])
+
+  # <picture> media queries and srcset pick a breakpoint by width alone, so each breakpoint serves a
+  # contiguous run of widths. cost[i, j] is the pixels sent when one breakpoint serves width groups
+  # i..j: it is as wide as group j and as tall as the tallest viewport it has to cover.
+  size = len(widths)
+  count = min(count, size)
+  cumulative_weights = np.concatenate(([0.0], np.cumsum(group_weights)))
+  cost = np.full((size, size), np.inf)
+  for i in range(size):
+    heights = np.maximum.accumulate(group_heights[i:])
+    cost[i, i:] = widths[i:] * heights * (cumulative_weights[i + 1:] - cumulative_weights[i])
+
+  best = [cost[0]]
+  splits = []
+  for _ in range(1, count):
+    candidates = best[-1][:-1, None] + cost[1:, :]
+    split = np.argmin(candidates, axis=0)
+    splits.append(split + 1)
+    best.append(candidates[split, np.arange(size)])
+
+  breakpoints = []
+  end = size - 1
+  for n in range(count - 1, -1, -1):
+    start = splits[n - 1][end] if n else 0
+    breakpoints.append((int(widths[end]), int(group_heights[start:end + 1].max())))
+    end = start - 1
+
+  return sorted(breakpoints), float(best[-1][size - 1] / weights.sum())
+
+def export_image_sizes(breakpoint_sets: Dict[int, List[Tuple[int, int]]], sizes_path: str = 'implementation/assets/image-sizes.json') -> None:
+  image_sizes = {}
+  for count, breakpoints in sorted(breakpoint_sets.items()):
+    image_sizes[f"picture-opt-{count}"] = breakpoints
+    image_sizes[f"srcset-opt-{count}"] = breakpoints
+
+  with open(sizes_path, 'w') as f:
+    json.dump(image_sizes, f, indent=2)
+
 def calculate_pixel_waste(primary_sizes: List[Tuple[int, int]], common_sizes: List[Tuple[int, int]], byte_per_pixel: int = 3) -> float:
   primary_sizes.sort(key=lambda x: (x[0], x[1]))
   total_waste, total_area = 0, 0
@@ -49,13 +174,46 @@ def calculate_single_image_waste(image_width: int, image_height: int, common_siz
 
   return total_waste / total_area * 100
 
-common_sizes = get_common_viewport_sizes()
+def main() -> None:
+  breakpoint_counts = [3, 5]
+  sizes_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'implementation', 'assets', 'image-sizes.json')
+  args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+  write_sizes = '--write-sizes' in sys.argv[1:]
+
+  if args:
+    for model, (waste, waste_pixels, waste_bytes) in summarise_viewport_log(args[0]).items():
+      print(f"Average pixel waste for {model}: {waste:.2f}% ({waste_pixels:,.0f}px, {waste_bytes:,.0f} bytes per view)")
+
+    viewports, weights = read_viewport_log(args[0])
+    for model, breakpoints in (('3-breakpoint', get_three_breakpoint()), ('5-breakpoint', get_five_breakpoint())):
+      share = uncovered_share(breakpoints, viewports, weights)
+      if share:
+        print(f"{share:.1f}% of views exceed every {model} image and are counted as served by the widest one")
+    breakpoint_sets = {}
+    for count in breakpoint_counts:
+      breakpoints, transferred = optimal_breakpoints(viewports, weights, count)
+      waste, waste_pixels, waste_bytes = breakpoint_waste(breakpoints, viewports, weights)
+      breakpoint_sets[count] = breakpoints
+      print(f"\nOptimal {count}-breakpoint set: {', '.join(f'{w}x{h}' for w, h in breakpoints)}")
+      print(f"Transferred pixels per view = {transferred:,.0f}, average pixel waste = {waste:.2f}% ({waste_pixels:,.0f}px per view)")
+
+    if write_sizes:
+      export_image_sizes(breakpoint_sets, sizes_path)
+      print("\nBreakpoint sets written to implementation/assets/image-sizes.json")
+    else:
+      print("\nRun with --write-sizes to write these sets to implementation/assets/image-sizes.json")
+    return
+
+  common_sizes = get_common_viewport_sizes()
+
+  average_waste_3 = calculate_pixel_waste(get_three_breakpoint(), common_sizes)
+  print(f"\nAverage pixel waste for 3-breakpoint model: {average_waste_3:.2f}%\n")
 
-average_waste_3 = calculate_pixel_waste(get_three_breakpoint(), common_sizes)
-print(f"\nAverage pixel waste for 3-breakpoint model: {average_waste_3:.2f}%\n")
+  average_waste_5 = calculate_pixel_waste(get_five_breakpoint(), common_sizes)
+  print(f"\nAverage pixel waste for 5-breakpoint model: {average_waste_5:.2f}%\n")
 
-average_waste_5 = calculate_pixel_waste(get_five_breakpoint(), common_sizes)
-print(f"\nAverage pixel waste for 5-breakpoint model: {average_waste_5:.2f}%\n")
+  single_image_waste = calculate_single_image_waste(1920, 1080, common_sizes)
+  print(f"\nAverage pixel waste for benchmark: {single_image_waste:.2f}%\n")
 
-single_image_waste = calculate_single_image_waste(1920, 1080, common_sizes)
-print(f"\nAverage pixel waste for benchmark: {single_image_waste:.2f}%\n")
\ No newline at end of file
+if __name__ == "__main__":
+  main()
\ No newline at end of file